@@ -2,7 +2,7 @@
 Run import_track.py using all tracks found with a glob-style search string
 
 Usage:
-    batch_import_track.py <connection_txt> <search_str> [--seg_time_diff=<int>] [--min_point_distance=<int>] [--registration=<str>] [--ssl_cert_path=<str>] [--submission_method=<str>] [--operator_code=<str>] [--aircraft_type=<str>] [--walk_dir_tree] [--ignore_duplicate_flights]
+    batch_import_track.py <connection_txt> <search_str> [--seg_time_diff=<int>] [--min_point_distance=<int>] [--registration=<str>] [--ssl_cert_path=<str>] [--submission_method=<str>] [--operator_code=<str>] [--aircraft_type=<str>] [--walk_dir_tree] [--ignore_duplicate_flights] [--workers=<int>]
     batch_import_track.py <connection_txt> --show_operators
 
 Examples:
@@ -35,6 +35,8 @@ Options:
     -w, --walk_dir_tree             Search for files in all sub-dirs of the directory specified by search_str. Only
                                     files with a recognizable file extension (.gdb, .gpx, .kml, or .csv) will be processed
     -i, --ignore_duplicate_flights  Import all flights except those that already exist in the database
+    -n, --workers=<int>             Number of processes to use for reading and formatting track files. Tracks are still
+                                    written to the database one at a time through a single connection [default: 1]
 
 """
 
@@ -42,11 +44,80 @@ import sys, os
 import re
 import glob
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+import db_utils
 import import_track
 
+# Maximum number of tracks per worker process that are being formatted or waiting to be imported at once
+MAX_PENDING_PER_WORKER = 2
 
-def main(connection_txt, search_str, seg_time_diff=15, min_point_distance=200, operator_code=None, aircraft_type=None, registration=None, walk_dir_tree=False, force_import=False, ssl_cert_path=None, ignore_duplicate_flights=False):
+
+def show_progress(path, this_n, n_tracks):
+    # Show progress (\r returns to the start of the current line and \033[K clears it)
+    sys.stdout.write('\r\033[KProcessing {path} | {this_n:d} of {n_tracks:d} ({percent:.1f}%)'
+                     .format(path=os.path.basename(path), this_n=this_n, n_tracks=n_tracks, percent=float(this_n)/n_tracks * 100))
+
+
+def import_in_parallel(connection_txt, track_paths, workers, seg_time_diff=15, min_point_distance=200, operator_code=None, aircraft_type=None, registration=None, force_import=False, ssl_cert_path=None, ignore_duplicate_flights=False):
+    '''
+    Read and format tracks in a pool of worker processes and import each one as soon as it's ready. Reading and
+    formatting is CPU-bound, so it scales with the number of processes, but all database writes happen in this process
+    through a single connection so the number of connections doesn't grow with the number of workers. Only a few
+    tracks per worker are submitted at a time so formatted tracks don't pile up in memory if reading is faster than
+    importing
+
+    :return: dictionary of {path: exception} for all tracks that failed
+    '''
+    failed_tracks = {}
+    n_tracks = len(track_paths)
+    format_kwargs = dict(seg_time_diff=seg_time_diff,
+                         min_point_distance=min_point_distance,
+                         registration=registration,
+                         submission_method='manual',
+                         operator_code=operator_code,
+                         aircraft_type=aircraft_type,
+                         force_registration=False)
+
+    engine = db_utils.connect_db(connection_txt)
+    path_iter = iter(track_paths)
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        while True:
+            # Refill the window of in-flight tracks
+            for path in path_iter:
+                futures[executor.submit(import_track.format_track, path, **format_kwargs)] = path
+                if len(futures) >= MAX_PENDING_PER_WORKER * workers:
+                    break
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            future = done.pop()
+            path = futures.pop(future)
+            n_done += 1
+            show_progress(path, n_done, n_tracks)
+            try:
+                import_track.import_data(data=future.result(),
+                                         path=path,
+                                         engine=engine,
+                                         seg_time_diff=seg_time_diff,
+                                         min_point_distance=min_point_distance,
+                                         registration=registration,
+                                         submission_method='manual',
+                                         operator_code=operator_code,
+                                         aircraft_type=aircraft_type,
+                                         force_import=force_import,
+                                         ssl_cert_path=ssl_cert_path,
+                                         ignore_duplicate_flights=ignore_duplicate_flights)
+            except Exception as e:
+                failed_tracks[path] = e
+
+    return failed_tracks
+
+
+def main(connection_txt, search_str, seg_time_diff=15, min_point_distance=200, operator_code=None, aircraft_type=None, registration=None, walk_dir_tree=False, force_import=False, ssl_cert_path=None, ignore_duplicate_flights=False, workers=1):
 
     subprocess.call('', shell=True) #For some reason, this enables ANSII escape characters to be properly read by cmd.exe
 
@@ -67,28 +138,41 @@ def main(connection_txt, search_str, seg_time_diff=15, min_point_distance=200, o
             raise ValueError('No tracks found with the search_str %s. Is this a directory that you meant to use with '
                              '--walk_dir_tree? For help, try python batch_import_track.py --help' % search_str)
 
-    failed_tracks = {}
-    n_tracks = len(track_paths)
-    for i, path in enumerate(track_paths):
-        # Show progress (\r returns to the start of the current line and \033[K clears it)
-        sys.stdout.write('\r\033[KProcessing {path} | {this_n:d} of {n_tracks:d} ({percent:.1f}%)'
-                         .format(path=os.path.basename(path), this_n=i + 1, n_tracks=n_tracks, percent=float(i + 1)/n_tracks * 100))
-        
-        try:
-            import_track.import_data(connection_txt,
-                                      path=path,
-                                      seg_time_diff=seg_time_diff,
-                                      min_point_distance=min_point_distance,
-                                      registration=registration,
-                                      submission_method='manual',
-                                      operator_code=operator_code,
-                                      aircraft_type=aircraft_type,
-                                      force_import=force_import,
-                                      ssl_cert_path=ssl_cert_path,
-                                      ignore_duplicate_flights=ignore_duplicate_flights)
-
-        except Exception as e:
-            failed_tracks[path] = e
+    # Look up the table columns import_data() needs once for the whole batch rather than for the first track and then
+    #   again each time the cache expires
+    db_utils.warm_cache(db_utils.connect_db(connection_txt))
+
+    if workers > 1:
+        failed_tracks = import_in_parallel(connection_txt, track_paths, workers, seg_time_diff=seg_time_diff,
+                                           min_point_distance=min_point_distance, operator_code=operator_code,
+                                           aircraft_type=aircraft_type, registration=registration,
+                                           force_import=force_import, ssl_cert_path=ssl_cert_path,
+                                           ignore_duplicate_flights=ignore_duplicate_flights)
+    else:
+        failed_tracks = {}
+        n_tracks = len(track_paths)
+        for i, path in enumerate(track_paths):
+            show_progress(path, i + 1, n_tracks)
+
+            try:
+                import_track.import_data(connection_txt,
+                                          path=path,
+                                          seg_time_diff=seg_time_diff,
+                                          min_point_distance=min_point_distance,
+                                          registration=registration,
+                                          submission_method='manual',
+                                          operator_code=operator_code,
+                                          aircraft_type=aircraft_type,
+                                          force_import=force_import,
+                                          ssl_cert_path=ssl_cert_path,
+                                          ignore_duplicate_flights=ignore_duplicate_flights)
+
+            except Exception as e:
+                failed_tracks[path] = e
+
+    # import_data() only records the rows it inserted, so clean up and update statistics on the changed tables once now
+    #   that the whole batch is done
+    db_utils.run_maintenance(db_utils.connect_db(connection_txt))
 
     n_failed = len(failed_tracks)
     if n_failed:
@@ -0,0 +1,123 @@
+"""
+Create the indexes that query_tracks.py relies on for fast date, time-of-day, and join filtering. Indexes that already
+exist are skipped, so this is safe to run more than once.
+
+Usage:
+    create_indexes.py <connection_txt> [--blocking]
+
+Examples:
+
+Required parameters:
+    connection_txt      Path of a text file containing information to connect to the DB. Each line
+                        in the text file must be in the form 'variable_name; variable_value.'
+                        Required variables: username, password, ip_address, port, db_name.
+
+Options:
+    -h, --help          Show this screen.
+    -b, --blocking      Option to build indexes with a plain CREATE INDEX, which is faster but blocks writes to each
+                        table while its index is built. By default, indexes are built CONCURRENTLY
+"""
+
+import sys
+import warnings
+from sqlalchemy import text as sqlalchemy_text
+
+import db_utils
+import partition_flight_points
+from utils import get_cl_args
+
+# (index name, table, indexed expression). Expression indexes on ak_datetime::time, etc. have to match the time-of-day
+#   filters in query_tracks.compose_query() exactly to be used. Casting a timestamp to a time is only immutable (and
+#   therefore indexable) for timestamps without a time zone
+QUERY_INDEXES = [
+    ('flight_points_ak_datetime_idx', 'flight_points', 'ak_datetime'),
+    ('flight_points_ak_time_idx', 'flight_points', '(ak_datetime::time)'),
+    ('flight_points_flight_id_idx', 'flight_points', 'flight_id'),
+    ('flight_lines_flight_id_idx', 'flight_lines', 'flight_id'),
+    ('flights_departure_datetime_idx', 'flights', 'departure_datetime'),
+    ('flights_departure_time_idx', 'flights', '(departure_datetime::time)'),
+    ('flights_landing_time_idx', 'flights', '(landing_datetime::time)')
+]
+
+
+def create_partitioned_index(conn, index_name, table, expression):
+    '''
+    Create an index on a partitioned table without blocking writes. CREATE INDEX CONCURRENTLY isn't supported on
+    partitioned tables, so create an (invalid) index on only the parent, build an index on each partition
+    concurrently, and attach each one. Once all partitions have an attached index, the parent index becomes valid.
+
+    :param conn: SQLAlchemy Connection in autocommit mode
+    :param index_name: name of the index on the parent table
+    :param table: name of the partitioned table
+    :param expression: indexed expression
+    '''
+    is_valid = conn.execute(
+        sqlalchemy_text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:index_name);'),
+        index_name=index_name
+    ).scalar()
+    if is_valid:
+        return
+
+    conn.execute('CREATE INDEX IF NOT EXISTS {index_name} ON ONLY {table} ({expression});'
+                 .format(index_name=index_name, table=table, expression=expression))
+    for partition in partition_flight_points.get_partitions(conn, table):
+        # Name partition indexes the same way Postgres does when it creates them automatically
+        partition_index = (partition + index_name[len(table):] if index_name.startswith(table)
+                           else '%s_%s' % (partition, index_name))[:63]
+        conn.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} ({expression});'
+                     .format(partition_index=partition_index, partition=partition, expression=expression))
+        # Attaching an index that's already attached to this parent does nothing
+        conn.execute('ALTER INDEX {index_name} ATTACH PARTITION {partition_index};'
+                     .format(index_name=index_name, partition_index=partition_index))
+
+
+def create_indexes(engine, indexes=QUERY_INDEXES, concurrently=True):
+    '''
+    Create each index in indexes if it doesn't already exist and update statistics on the indexed tables
+
+    :param engine: SQLAlchemy Engine
+    :param indexes: iterable of (index name, table, indexed expression) tuples
+    :param concurrently: if True, build each index without blocking writes to its table
+    :return: list of the names of the indexes that were created or already existed
+    '''
+    created = []
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        for index_name, table, expression in indexes:
+            try:
+                # Partitioned tables (see partition_flight_points.py) can't be indexed CONCURRENTLY directly
+                if partition_flight_points.is_partitioned(conn, table):
+                    if concurrently:
+                        create_partitioned_index(conn, index_name, table, expression)
+                    else:
+                        conn.execute('CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({expression});'
+                                     .format(index_name=index_name, table=table, expression=expression))
+                    created.append(index_name)
+                    continue
+                conn.execute('CREATE INDEX {concurrently} IF NOT EXISTS {index_name} ON {table} ({expression});'
+                             .format(concurrently='CONCURRENTLY' if concurrently else '',
+                                     index_name=index_name,
+                                     table=table,
+                                     expression=expression))
+                created.append(index_name)
+            except Exception as e:
+                warnings.warn('Could not create index {index_name} on {table} because {error}. If a concurrent build'
+                              ' failed, it might have left an INVALID index that has to be dropped before trying again'
+                              .format(index_name=index_name, table=table, error=e))
+
+    # The planner needs up-to-date statistics for expression indexes
+    db_utils.run_maintenance(engine, tables=sorted(set(table for _, table, _ in indexes)), vacuum=False)
+
+    return created
+
+
+def main(connection_txt, blocking=False):
+
+    engine = db_utils.connect_db(connection_txt)
+    created = create_indexes(engine, concurrently=not blocking)
+    print('Created or found %d of %d indexes:\n\t-%s' % (len(created), len(QUERY_INDEXES), '\n\t-'.join(created)))
+
+
+if __name__ == '__main__':
+    args = get_cl_args(__doc__)
+    sys.exit(main(**args))
@@ -1,8 +1,54 @@
+import io
+import time
+import warnings
 import psycopg2
-from sqlalchemy import create_engine
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine, text as sqlalchemy_text
 import pandas as pd
 
-def connect_db(connection_txt):
+CONNECTION_TEMPLATE = 'postgresql://{username}:{password}@{ip_address}:{port}/{db_name}'
+
+# Default connection pool settings for engines created by get_engine()
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_PRE_PING = True # test connections before using them so dropped connections are replaced transparently
+POOL_RECYCLE = 3600 # replace connections after this many seconds
+
+# Engines keyed by connection URL. Every engine has its own connection pool, so sharing them means that repeated calls
+#   in the same process reuse connections that are already established and authenticated
+_ENGINES = {}
+
+# Number of seconds that schema information and lookup tables are cached for
+CACHE_TTL = 600
+
+# Cached query results keyed by (database URL, kind of result, table name, ...). Values are (time cached, result)
+_CACHE = {}
+
+# Number of changed rows (since the table was last analyzed) after which maintain_changed_tables() runs ANALYZE on a
+#   table and number of dead rows after which it runs VACUUM ANALYZE instead
+ANALYZE_THRESHOLD = 100000
+VACUUM_THRESHOLD = 1000000
+
+# Postgres's own statistics on how many rows of each table have changed since it was last analyzed and how many dead
+#   rows are waiting to be vacuumed. These persist across connections and processes, so changes made by separate runs
+#   of the import scripts add up
+MAINTENANCE_STATS_SQL = '''
+    SELECT relname AS table_name, n_mod_since_analyze, n_dead_tup
+    FROM pg_stat_user_tables
+    WHERE schemaname = current_schema()
+'''
+
+# Names of the partitioned tables that any of :tables are partitions of
+PARTITIONED_PARENTS_SQL = '''
+    SELECT DISTINCT parent.relname AS table_name
+    FROM pg_inherits
+        INNER JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        INNER JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+    WHERE child.relname = ANY(:tables) AND parent.relkind = 'p'
+'''
+
+
+def read_connection_txt(connection_txt):
 
     connection_info = {}
     with open(connection_txt) as txt:
@@ -12,18 +58,112 @@ def connect_db(connection_txt):
             param_name, param_value = line.split(';')
             connection_info[param_name.strip()] = param_value.strip()
 
+    return connection_info
+
+
+def get_engine(connection_info, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=POOL_PRE_PING, pool_recycle=POOL_RECYCLE):
+    '''
+    Return the shared SQLAlchemy Engine for a set of connection parameters, creating it the first time it's requested.
+    Pool settings only apply when the engine is created.
+
+    :param connection_info: dictionary with username, password, ip_address, port, and db_name
+    :param pool_size: number of connections to keep open in the pool
+    :param max_overflow: number of connections allowed beyond pool_size when all pooled connections are in use
+    :param pool_pre_ping: if True, test each connection before handing it out
+    :param pool_recycle: number of seconds after which a connection is replaced
+    '''
     try:
-        engine = create_engine(
-            'postgresql://{username}:{password}@{ip_address}:{port}/{db_name}'.format(**connection_info))
+        url = CONNECTION_TEMPLATE.format(**connection_info)
+        if url not in _ENGINES:
+            _ENGINES[url] = create_engine(url,
+                                          pool_size=pool_size,
+                                          max_overflow=max_overflow,
+                                          pool_pre_ping=pool_pre_ping,
+                                          pool_recycle=pool_recycle)
     except:
-        message = '\n\t' + '\n\t'.join(['%s: %s' % (k, v) for k, v in connection_info.iteritems()])
+        message = '\n\t' + '\n\t'.join(['%s: %s' % (k, v) for k, v in connection_info.items()])
         raise ValueError('could not establish connection with parameters:%s' % message)
 
-    return engine
+    return _ENGINES[url]
+
+
+def dispose_engines():
+    '''Close all pooled connections and forget all shared engines'''
+    for engine in _ENGINES.values():
+        engine.dispose()
+    _ENGINES.clear()
+
+
+def connect_db(connection_txt, **pool_kwargs):
+
+    return get_engine(read_connection_txt(connection_txt), **pool_kwargs)
+
 
+def _get_cache_key(engine, conn, *args):
+    # Connections and Engines both have an .engine attribute, so use it to identify the database
+    connectable = conn if conn is not None else engine
 
-def get_lookup_table(engine=None, table=None, index_col='code', value_col='name', conn=None):
-    ''' Return a dictionary of code: name pairs from a given lookup table'''
+    return (str(connectable.engine.url),) + args
+
+
+def _get_cached(key, ttl=CACHE_TTL):
+    '''Return the cached result for key or None if it isn't cached or is older than ttl seconds'''
+    if key in _CACHE:
+        cache_time, result = _CACHE[key]
+        if ttl is None or time.time() - cache_time < ttl:
+            return result
+        del _CACHE[key]
+
+    return None
+
+
+def clear_cache(table=None):
+    '''
+    Invalidate cached schema information and lookup tables. If table is given, only entries for that table are removed.
+    This should be called after any change to the DB schema or to a lookup table.
+    '''
+    if table is None:
+        _CACHE.clear()
+    else:
+        for key in [k for k in _CACHE if len(k) > 2 and k[2] == table]:
+            del _CACHE[key]
+
+
+def warm_cache(engine=None, tables=('flights', 'flight_points', 'flight_lines'), lookup_tables=(), conn=None):
+    '''
+    Populate the cache for the columns of each table in tables and the default code: name pairs of each table in
+    lookup_tables so that later calls don't have to query the DB
+    '''
+    for table in tables:
+        get_db_columns(table, engine=engine, conn=conn)
+    for table in lookup_tables:
+        get_lookup_table(engine=engine, table=table, conn=conn)
+
+
+def get_table_names(engine=None, conn=None, ttl=CACHE_TTL):
+    ''' Return a pd.Series of names of all tables in the public schema'''
+
+    key = _get_cache_key(engine, conn, 'table_names')
+    table_names = _get_cached(key, ttl)
+    if table_names is None:
+        sql = "SELECT DISTINCT table_name FROM information_schema.tables WHERE table_schema = 'public';"
+        if not conn:
+            with engine.connect() as conn:
+                table_names = pd.read_sql(sql, conn)['table_name']
+        else:
+            table_names = pd.read_sql(sql, conn)['table_name']
+        _CACHE[key] = (time.time(), table_names)
+
+    return table_names.copy()
+
+
+def get_lookup_table(engine=None, table=None, index_col='code', value_col='name', conn=None, ttl=CACHE_TTL):
+    ''' Return a dictionary of code: name pairs from a given lookup table. Results are cached for ttl seconds'''
+
+    key = _get_cache_key(engine, conn, 'lookup_table', table, index_col, value_col)
+    lookup_values = _get_cached(key, ttl)
+    if lookup_values is not None:
+        return lookup_values.copy()
 
     #with engine.connect() as conn, conn.begin():
     if not conn:
@@ -32,8 +172,7 @@ def get_lookup_table(engine=None, table=None, index_col='code', value_col='name'
     else:
         close_conn = False
 
-    sql = "SELECT DISTINCT table_name FROM information_schema.tables WHERE table_schema = 'public';"
-    table_names = pd.read_sql(sql, conn).squeeze()
+    table_names = get_table_names(conn=conn, ttl=ttl)
 
     if table in table_names.values:
         data = pd.read_sql("SELECT * FROM %s" % table, conn)
@@ -52,10 +191,19 @@ def get_lookup_table(engine=None, table=None, index_col='code', value_col='name'
 
     data.set_index(index_col, inplace=True)
 
-    return data[value_col].to_dict()
+    lookup_values = data[value_col].to_dict()
+    _CACHE[key] = (time.time(), lookup_values)
+
+    return lookup_values.copy()
 
 
-def get_db_columns(table_name, engine=None, conn=None):
+def get_db_columns(table_name, engine=None, conn=None, ttl=CACHE_TTL):
+    ''' Return a pd.Series of the column names of a table. Results are cached for ttl seconds'''
+
+    key = _get_cache_key(engine, conn, 'columns', table_name)
+    db_columns = _get_cached(key, ttl)
+    if db_columns is not None:
+        return db_columns.copy()
 
     if not conn:
         with engine.connect() as conn, conn.begin():
@@ -69,4 +217,198 @@ def get_db_columns(table_name, engine=None, conn=None):
             conn
         )
 
-    return db_columns.squeeze()
\ No newline at end of file
+    db_columns = db_columns['column_name']
+    _CACHE[key] = (time.time(), db_columns)
+
+    return db_columns.copy()
+
+
+def copy_to_table(df, table_name, conn, geom_column='geom', srid=4326):
+    '''
+    Bulk insert a DataFrame with COPY instead of one INSERT per row. Rows are first copied into a temporary staging table
+    with the same column types as table_name (except geom_column, which is text) and then inserted with a single
+    INSERT ... SELECT. conn must be an SQLAlchemy Connection so that the COPY happens in the same transaction as
+    anything else executed with it.
+
+    :param df: DataFrame with columns that all exist in table_name
+    :param table_name: name of the table to insert into
+    :param conn: SQLAlchemy Connection
+    :param geom_column: name of a column containing hex-encoded WKB geometries, or None if there isn't one
+    :param srid: spatial reference ID of the geometries in geom_column
+    :return: number of rows inserted
+    '''
+    if not len(df):
+        return 0
+
+    df = df.copy()
+    # Floats that are really integers (i.e., integer columns with nulls) would be written as "1.0", which Postgres won't
+    #   accept for integer columns, so write them as nullable integers instead
+    for column in df.columns[df.dtypes.apply(pd.api.types.is_float_dtype)]:
+        values = df[column].dropna()
+        if (values == values.round()).all():
+            df[column] = df[column].round().astype('Int64')
+
+    column_names = ', '.join('"%s"' % c for c in df.columns)
+    select_columns = ', '.join(
+        'ST_SetSRID(CAST("{0}" AS geometry), {1})'.format(c, srid) if c == geom_column else '"%s"' % c
+        for c in df.columns
+    )
+    staging_table = '_copy_%s' % table_name
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    # conn.connection is the DBAPI connection that conn is using, so this cursor shares conn's transaction
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA;'
+                       .format(staging=staging_table, columns=column_names, table=table_name))
+        if geom_column in df.columns:
+            cursor.execute('ALTER TABLE {staging} ALTER COLUMN "{geom}" TYPE text;'
+                           .format(staging=staging_table, geom=geom_column))
+        cursor.copy_expert('COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv);'
+                           .format(staging=staging_table, columns=column_names),
+                           buffer)
+        cursor.execute('INSERT INTO {table} ({columns}) SELECT {select_columns} FROM {staging};'
+                       .format(table=table_name, columns=column_names, select_columns=select_columns,
+                               staging=staging_table))
+        n_rows = cursor.rowcount
+        cursor.execute('DROP TABLE {staging};'.format(staging=staging_table))
+    finally:
+        cursor.close()
+
+    return n_rows
+
+
+def insert_returning(df, table_name, conn, returning=('id',), page_size=1000):
+    '''
+    INSERT all rows of a DataFrame and return the values of the returning columns (e.g., generated primary keys) for
+    each inserted row. Postgres doesn't guarantee that RETURNING rows come back in the order they were given, so
+    returning should include a column that identifies each input row (e.g., flight_id) and the result should be
+    merged on that column rather than aligned with df by position.
+
+    :param df: DataFrame with columns that all exist in table_name
+    :param table_name: name of the table to insert into
+    :param conn: SQLAlchemy Connection (the INSERT is part of its transaction)
+    :param returning: iterable of column names to return
+    :param page_size: maximum number of rows per INSERT statement
+    :return: DataFrame of the returning columns in no particular order
+    '''
+    returning = list(returning)
+    if not len(df):
+        return pd.DataFrame(columns=returning)
+
+    # psycopg2 can't adapt numpy types, so convert everything to Python objects and nulls to None
+    values = df.astype(object).where(df.notna(), None)
+    sql = 'INSERT INTO {table} ({columns}) VALUES %s RETURNING {returning}'.format(
+        table=table_name,
+        columns=', '.join('"%s"' % c for c in df.columns),
+        returning=', '.join('"%s"' % c for c in returning)
+    )
+
+    cursor = conn.connection.cursor()
+    try:
+        rows = execute_values(cursor, sql, list(values.itertuples(index=False, name=None)), page_size=page_size,
+                              fetch=True)
+    finally:
+        cursor.close()
+
+    return pd.DataFrame(rows, columns=returning)
+
+
+def get_maintenance_stats(engine, tables=None):
+    '''
+    Get the number of rows of each table that have changed since it was last analyzed and the number of dead rows it
+    has from pg_stat_user_tables. Postgres updates these statistics shortly after each transaction commits.
+
+    :param engine: SQLAlchemy Engine
+    :param tables: iterable of table names to limit the result to. If not given, get stats for every table
+    :return: DataFrame indexed by table name with the columns n_mod_since_analyze and n_dead_tup
+    '''
+    sql = MAINTENANCE_STATS_SQL
+    params = {}
+    if tables is not None:
+        sql += ' AND relname = ANY(:tables)'
+        params['tables'] = list(tables)
+
+    with engine.connect() as conn:
+        return pd.read_sql(sqlalchemy_text(sql), conn, params=params, index_col='table_name')
+
+
+def run_maintenance(engine, tables=None, vacuum=True, min_rows=1):
+    '''
+    Run VACUUM ANALYZE (or just ANALYZE if vacuum is False) on tables. If tables isn't given, maintain every table with
+    at least min_rows rows changed since it was last analyzed (or dead rows, if vacuum is True) according to
+    get_maintenance_stats(). If any of the tables are partitions, their partitioned (parent) tables are analyzed too
+    because autovacuum never does. This should be called once at the end of a batch of imports rather than after each
+    one. Failures only produce a warning because maintenance isn't critical.
+
+    :param engine: SQLAlchemy Engine
+    :param tables: iterable of table names
+    :param vacuum: if False, only run ANALYZE, which is much cheaper on large tables than VACUUM
+    :param min_rows: minimum number of changed (or dead) rows for a table to be maintained when tables isn't given
+    :return: list of the tables that were maintained
+    '''
+    if tables is None:
+        try:
+            stats = get_maintenance_stats(engine)
+        except:
+            warnings.warn('Unable to read table statistics to find the tables that need to be maintained')
+            return []
+        needs_maintenance = stats.n_mod_since_analyze >= min_rows
+        if vacuum:
+            needs_maintenance |= stats.n_dead_tup >= min_rows
+        tables = stats.index[needs_maintenance].tolist()
+
+    command = 'VACUUM ANALYZE' if vacuum else 'ANALYZE'
+    maintained = []
+    if not len(tables):
+        return maintained
+
+    # VACUUM can't run inside a transaction block
+    tables = list(tables)
+    try:
+        with engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+            # The planner uses the statistics of a partitioned table itself for queries that span partitions, and
+            #   ANALYZE on the partitions doesn't update them
+            parents = pd.read_sql(sqlalchemy_text(PARTITIONED_PARENTS_SQL), conn, params={'tables': tables})
+            parents = [table for table in parents.table_name if table not in tables]
+            for table in tables:
+                conn.execute('%s %s;' % (command, table))
+                maintained.append(table)
+            for table in parents:
+                conn.execute('ANALYZE %s;' % table)
+                maintained.append(table)
+    except:
+        warnings.warn("Unable to run {command} on {tables}. You should connect to the database and manually run"
+                      " '{command} <table_name>;' on each of these tables to ensure queries are as efficient as possible"
+                      .format(command=command, tables=', '.join(t for t in tables if t not in maintained)))
+
+    return maintained
+
+
+def maintain_changed_tables(engine, tables, analyze_threshold=ANALYZE_THRESHOLD, vacuum_threshold=VACUUM_THRESHOLD):
+    '''
+    Run ANALYZE or VACUUM ANALYZE on any of tables that have changed enough since they were last maintained. The
+    decision is based on get_maintenance_stats() rather than on what this process changed, so many small imports in
+    separate runs eventually trigger maintenance too. Call this only after the transaction that changed the rows has
+    been committed.
+
+    :param engine: SQLAlchemy Engine
+    :param tables: iterable of names of tables that changed
+    :param analyze_threshold: number of rows changed since the last ANALYZE that triggers ANALYZE
+    :param vacuum_threshold: number of dead rows that triggers VACUUM ANALYZE
+    :return: list of the tables that were maintained
+    '''
+    try:
+        stats = get_maintenance_stats(engine, tables)
+    except:
+        warnings.warn('Unable to read table statistics to decide whether {tables} need to be maintained'
+                      .format(tables=', '.join(tables)))
+        return []
+
+    to_vacuum = stats.index[stats.n_dead_tup >= vacuum_threshold].tolist()
+    to_analyze = stats.index[(stats.n_mod_since_analyze >= analyze_threshold) & ~stats.index.isin(to_vacuum)].tolist()
+
+    return run_maintenance(engine, to_vacuum, vacuum=True) + run_maintenance(engine, to_analyze, vacuum=False)
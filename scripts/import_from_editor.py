@@ -26,9 +26,7 @@ def main(geojson_path, track_info_json, config_json, ignore_duplicates=False):
     with open(track_info_json) as j:
         track_info = json.load(j)
 
-    connection_info = params['db_credentials']['tracks']
-    engine = create_engine('postgresql://{username}:{password}@{ip_address}:{port}/{db_name}'
-                           .format(**connection_info))
+    engine = db_utils.get_engine(params['db_credentials']['tracks'])
     flight_columns = db_utils.get_db_columns('flights', engine)
 
     # assign constants (that will eventually wind up in the fights table) to gdf
@@ -51,6 +49,7 @@ def main(geojson_path, track_info_json, config_json, ignore_duplicates=False):
     gdf = import_track.get_flight_id(gdf, seg_time_diff)
 
     import_track.import_data(engine=engine, data=gdf, path=track_info['name'], ignore_duplicate_flights=ignore_duplicates, called_from_editor=True, **import_params)
+    db_utils.run_maintenance(engine, vacuum=False)
 
 
 if __name__ == '__main__':
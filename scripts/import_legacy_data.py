@@ -25,7 +25,7 @@ def main(access_db_path, connection_txt, ssl_cert):
 
     track_points = gpd.GeoDataFrame(
         track_points,
-        geometry=[shapely_Point(x, y, z) for x, y, z in zip(track_points.longitude, track_points.latitude, track_points.altitude_ft)]
+        geometry=get_point_geometry(track_points.longitude, track_points.latitude, track_points.altitude_ft)
     )
 
     track_points['operator_code'] = 'NPS'
@@ -33,9 +33,8 @@ def main(access_db_path, connection_txt, ssl_cert):
     for registration, gdf in track_points.groupby('registration'):
         gdf.sort_values('ak_datetime', inplace=True)
 
-        gdf['diff_m'] = calc_distance_to_last_pt(gdf)
-        gdf['diff_seconds'] = gdf.utc_datetime.diff().dt.seconds
-        gdf.loc[gdf.diff_seconds.isnull() | (gdf.diff_seconds == 0) | (gdf.diff_seconds > SEG_TIME_DIFF * 60), 'diff_seconds'] = -1
+        # Speed and heading are already in the Access DB
+        gdf = derive_kinematics(gdf, SEG_TIME_DIFF, skip_fields=['m_per_sec', 'knots', 'previous_lat', 'previous_lon', 'heading'])
         gdf = get_flight_id(gdf, SEG_TIME_DIFF) \
             .drop(gdf.index[((gdf.diff_m < MIN_POINT_DISTANCE) & (gdf.utc_datetime.diff().dt.seconds == 0))]) \
             .dropna(subset=['ak_datetime']) \
@@ -53,5 +52,7 @@ def main(access_db_path, connection_txt, ssl_cert):
         except:
             print(f'\n\nFailed for {registration}. Error: {traceback.format_exc()}')
 
+    db_utils.run_maintenance(db_utils.connect_db(connection_txt))
+
 if __name__ == '__main__':
     sys.exit(main(*sys.argv[1:]))
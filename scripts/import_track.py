@@ -37,12 +37,11 @@ Options:
 """
 
 import sys, os
+import io
 import re
 import pytz
-import math
 import random
 import string
-import pyproj
 import shutil
 import warnings
 import subprocess
@@ -50,20 +49,23 @@ import smtplib
 import chardet.universaldetector
 import docopt
 import requests
-import bs4
 import numpy as np
 import pandas as pd
 #import gdal # this import is unused, but for some reason geopandas (shapely, actually) won't load unless gdal is imported first
 import geopandas as gpd
 from datetime import datetime, timedelta
-from geoalchemy2 import Geometry, WKTElement
-from shapely.geometry import LineString as shapely_LineString, Point as shapely_Point
+from sqlalchemy import text as sqlalchemy_text
+from shapely.geometry import LineString as shapely_LineString
 
 import db_utils
+import query_cache
+import partition_flight_points
+import simplify_lines
+import track_summaries
 import update_aircraft_info as ainfo
 import process_emails
 import kml_parser
-from utils import get_cl_args
+from utils import get_cl_args, get_transformer
 
 
 # Patterns of column names for different csv sources
@@ -120,37 +122,96 @@ ARCHIVE_DIR = r'\\inpdenaterm01\overflights\imported_files\tracks'
 
 REGISTRATION_REGEX = r'(?i)N\d{1,5}[A-Z]{0,2}'
 
+# GSAT coordinates are in the format 62°37'21.9600"N 150°44'42.0000"W in a single Lat/Lng field
+GSAT_COORDINATE_REGEX = \
+    r'(?P<lat_deg>-?[\d.]+)[°\'"]+(?P<lat_min>[\d.]+)[°\'"]+(?P<lat_sec>[\d.]+)[°\'"]+(?P<lat_dir>[NS]?)\s+' \
+    r'(?P<lon_deg>-?[\d.]+)[°\'"]+(?P<lon_min>[\d.]+)[°\'"]+(?P<lon_sec>[\d.]+)[°\'"]+(?P<lon_dir>[EW]?)'
+
 FEET_PER_METER = 3.2808399
 M_PER_S_TO_KNOTS = 1.94384
 
+# Number of bytes at the start of a CSV to use for detecting the encoding, header row, and source type
+CSV_SNIFF_BYTES = 65536
+
 def calc_bearing(lat1, lon1, lat2, lon2):
     '''
-    Calculate bearing from two lat/lon coordinates. Logic from https://gist.github.com/jeromer/2005586
+    Calculate bearing from two lat/lon coordinates. Logic from https://gist.github.com/jeromer/2005586. Coordinates can
+    be either scalars or equal-length arrays, in which case the bearing is calculated element-wise
 
-    :return: integer compass bearing (between 0-360°)
+    :return: compass bearing (between 0-360°)
     '''
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
 
-    longitude_diff = math.radians(lon2 - lon1)
+    longitude_diff = np.radians(np.subtract(lon2, lon1))
 
-    x = math.sin(longitude_diff) * math.cos(lat2_rad)
-    y = math.cos(lat1_rad) * math.sin(lat2_rad) - \
-        (math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(longitude_diff))
+    x = np.sin(longitude_diff) * np.cos(lat2_rad)
+    y = np.cos(lat1_rad) * np.sin(lat2_rad) - \
+        (np.sin(lat1_rad) * np.cos(lat2_rad) * np.cos(longitude_diff))
 
-    initial_bearing = math.degrees(math.atan2(x, y))
+    initial_bearing = np.degrees(np.arctan2(x, y))
 
-    # math.atan2 returns values from -180° to + 180°, so convert to 0-360
-    compass_bearing = (initial_bearing + 360) % 360
+    # np.arctan2 returns values from -180° to + 180°, so convert to 0-360
+    compass_bearing = np.mod(initial_bearing + 360, 360)
 
     return compass_bearing
 
 
+def calc_heading(latitude, longitude):
+    '''
+    Calculate the heading of each point in a track from the point before it. Points must already be sorted in
+    chronological order.
+
+    :param latitude: array-like of latitudes in decimal degrees
+    :param longitude: array-like of longitudes in decimal degrees
+    :return: integer array of compass bearings. The first point (and any point without valid coordinates) is -1
+    '''
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+
+    heading = np.full(len(latitude), -1, dtype=int)
+    if len(latitude) > 1:
+        bearing = np.round(calc_bearing(latitude[:-1], longitude[:-1], latitude[1:], longitude[1:]))
+        heading[1:] = np.where(np.isnan(bearing), -1, bearing)
+
+    return heading
+
+
+def get_point_geometry(longitude, latitude, altitude_ft):
+    '''
+    Make 3D point geometries from coordinate arrays in a single vectorized call rather than creating a shapely Point
+    per row
+
+    :param longitude: array-like of longitudes in decimal degrees
+    :param latitude: array-like of latitudes in decimal degrees
+    :param altitude_ft: array-like of altitudes in feet, used as the Z coordinate
+    :return: GeometryArray of Point Z geometries in the same order as the input arrays
+    '''
+    return gpd.points_from_xy(np.asarray(longitude, dtype=float),
+                              np.asarray(latitude, dtype=float),
+                              np.asarray(altitude_ft, dtype=float))
+
+
+def get_utc_offset(naive_datetimes, timezone):
+    '''
+    Vectorized equivalent of naive_datetimes.apply(timezone.utcoffset): get the UTC offset of each naive datetime,
+    interpreted as a local time in the given timezone. As with pytz's utcoffset(), ambiguous and non-existent local
+    times (i.e., during DST transitions) raise an error. NaT values return NaT.
+
+    :param naive_datetimes: pd.Series of timezone-naive datetimes
+    :param timezone: pytz timezone
+    :return: pd.Series of timedeltas
+    '''
+    localized = naive_datetimes.dt.tz_localize(timezone)
+
+    return localized.dt.tz_localize(None) - localized.dt.tz_convert('UTC').dt.tz_localize(None)
+
+
 def calc_distance_to_last_pt(gdf):
 
     #in_proj = pyproj.Proj('epsg:4326')
     #out_proj = pyproj.Proj('epsg:3338') # Alaska Albers Equal Area, which is pretty good at preserving distances
-    transformer = pyproj.Transformer.from_crs('epsg:4326', 'epsg:3338')
+    transformer = get_transformer('epsg:4326', 'epsg:3338')
     # for some reason you specify .transform() with y, x but it returns x, y
     gdf['x_albers'], gdf['y_albers'] = transformer.transform(gdf.latitude.values, gdf.longitude.values)#pyproj.transform(in_proj, out_proj, gdf.longitude.values, gdf.latitude.values)
     distance = (gdf.x_albers.diff()**2 + gdf.y_albers.diff()**2)**0.5 # distance between 2 points
@@ -158,6 +219,66 @@ def calc_distance_to_last_pt(gdf):
     return distance
 
 
+def derive_kinematics(gdf, seg_time_diff=15, skip_fields=()):
+    '''
+    Calculate all fields derived from the position and timestamp of consecutive track points: x_albers, y_albers,
+    diff_m, diff_seconds, m_per_sec, knots, previous_lat, previous_lon, and heading. Points must already be sorted in
+    chronological order. Coordinates are projected once and every field is calculated from the resulting arrays, so
+    the whole frame is never shifted.
+
+    :param gdf: GeoDataFrame of track points with latitude, longitude, and utc_datetime columns
+    :param seg_time_diff: Minimum time in minutes between two points indicating the start of a new track segment.
+                          diff_seconds is -1 for these points and for points without a unique timestamp
+    :param skip_fields: iterable of derived field names that should not be calculated, either because they aren't
+                        needed or because the source data already provide them. knots and heading are never
+                        overwritten if they're already in the data
+    :return: the same GeoDataFrame with derived fields added
+    '''
+    skip_fields = set(skip_fields)
+    n_points = len(gdf)
+
+    latitude = gdf.latitude.to_numpy(dtype=float)
+    longitude = gdf.longitude.to_numpy(dtype=float)
+
+    # for some reason you specify .transform() with y, x but it returns x, y
+    transformer = get_transformer('epsg:4326', 'epsg:3338')
+    x_albers, y_albers = transformer.transform(latitude, longitude)
+    gdf['x_albers'] = x_albers
+    gdf['y_albers'] = y_albers
+
+    diff_m = np.full(n_points, np.nan)
+    diff_m[1:] = (np.diff(x_albers) ** 2 + np.diff(y_albers) ** 2) ** 0.5
+    if 'diff_m' not in skip_fields:
+        gdf['diff_m'] = diff_m
+
+    diff_seconds = np.array(gdf.utc_datetime.diff().dt.seconds, dtype=float)
+    diff_seconds[np.isnan(diff_seconds) | (diff_seconds == 0) | (diff_seconds > (seg_time_diff * 60))] = -1
+    if 'diff_seconds' not in skip_fields:
+        gdf['diff_seconds'] = diff_seconds
+
+    m_per_sec = diff_m / diff_seconds
+    if 'm_per_sec' not in skip_fields:
+        gdf['m_per_sec'] = m_per_sec
+
+    if 'knots' not in skip_fields:
+        if 'knots' in gdf:
+            gdf.loc[(gdf.knots < 0) | gdf.knots.isnull(), 'knots'] = 0
+        else:
+            knots = np.round(m_per_sec * M_PER_S_TO_KNOTS) # 1m/s == 1.94384 knots
+            knots[np.isnan(knots) | (knots < 0)] = 0
+            gdf['knots'] = knots.astype(int)
+
+    if 'previous_lat' not in skip_fields:
+        gdf['previous_lat'] = np.concatenate([[np.nan], latitude[:-1]]) if n_points else latitude
+    if 'previous_lon' not in skip_fields:
+        gdf['previous_lon'] = np.concatenate([[np.nan], longitude[:-1]]) if n_points else longitude
+
+    if 'heading' not in skip_fields and 'heading' not in gdf:
+        gdf['heading'] = calc_heading(latitude, longitude)
+
+    return gdf
+
+
 def read_gpx(path, seg_time_diff=15):
 
     gdf = gpd.read_file(path, layer='track_points')#, geometry='geometry')
@@ -165,30 +286,17 @@ def read_gpx(path, seg_time_diff=15):
     # Convert to datetime. It's almost in the right format to be read automatically except there's a T instead of a
     #   space between the date and the time
     gdf['utc_datetime'] = pd.to_datetime(gdf.time)
-    gdf = gdf.loc[~gdf.utc_datetime.isna()] # drop any points without a time. some garmin GPX files do this
+    gdf = gdf.loc[~gdf.utc_datetime.isna()].copy() # drop any points without a time. some garmin GPX files do this
 
     # Make points 3D
     gdf['altitude_ft'] = (gdf.ele * FEET_PER_METER).astype(int)
-    gdf.geometry = gdf.apply(lambda row: shapely_Point(row.geometry.x, row.geometry.y, row.altitude_ft), axis=1)
-
     gdf['longitude'] = gdf.geometry.x
     gdf['latitude'] = gdf.geometry.y
+    gdf.geometry = get_point_geometry(gdf.longitude, gdf.latitude, gdf.altitude_ft)
 
     # Calculate speed and bearing because GPX files don't have it
     gdf.sort_values(by='utc_datetime', inplace=True)
-    gdf['diff_m'] = calc_distance_to_last_pt(gdf)
-    gdf['diff_seconds'] = gdf.utc_datetime.diff().dt.seconds
-    gdf.loc[gdf.diff_seconds.isnull() | (gdf.diff_seconds == 0) | (gdf.diff_seconds > (seg_time_diff * 60)), 'diff_seconds'] = -1
-    gdf['m_per_sec'] = gdf.diff_m / gdf.diff_seconds
-    gdf['knots'] = (gdf.m_per_sec * M_PER_S_TO_KNOTS).fillna(-1).round().astype(int)# 1m/s == 1.94384 knots
-    gdf.loc[(gdf.knots < 0) | gdf.knots.isnull(), 'knots'] = 0
-
-    gdf['previous_lat'] = gdf.shift().latitude
-    gdf['previous_lon'] = gdf.shift().longitude
-    gdf['heading'] = gdf.apply(lambda row:
-                                    calc_bearing(*row[['previous_lat', 'previous_lon', 'latitude', 'longitude']]),
-                               axis=1)\
-        .fillna(-1).round().astype(int)
+    gdf = derive_kinematics(gdf, seg_time_diff)
 
     return gdf
 
@@ -219,69 +327,22 @@ def read_gdb(path, seg_time_diff=None):
     return read_gpx(out_path)
 
 
-def parse_web_sentinel_xml(parser, seg_time_diff=15):
-
-    points = []
-    for placemark in parser.find_all('Placemark'):
-        if placemark.find('styleUrl').text == '#waypt':
-            if not placemark.description:
-                raise ValueError
-            content = {
-                k.strip(): v.strip() for k, v in
-                [
-                    [j for j in i.split(':', 1)]
-                    for i in placemark.description.text.split('\n')
-                    if ':' in i
-                ]
-            }
-            coordinate_el = placemark.find('coordinates')
-            if not coordinate_el:
-                raise ValueError
-            coordinates = [c.strip() for c in coordinate_el.text.split(',')]
-            content['latitude'] = float(coordinates[1])
-            content['longitude'] = float(coordinates[0])
-            if len(coordinates) > 2:
-                content['altitude_ft'] = float(coordinates[2])
-            elif 'Feet' in content:
-                content['altitude_ft'] = float(content['Feet'])
-            else:
-                raise RuntimeError('No altitude value for point in KML file:\n%s' % placemark.prettify())
-
-            if 'Knots' in content:
-                content['knots'] = float(content['Knots'])
-            content['utc_datetime'] = pd.to_datetime(content['UTC'])
+def parse_web_sentinel_xml(path, seg_time_diff=15):
 
-            points.append(content)
+    df = pd.DataFrame(kml_parser.WebSentinelKMLParser().parse(path))
+    df['utc_datetime'] = pd.to_datetime(df['UTC'])
 
-    df = pd.DataFrame(points).sort_values('utc_datetime')
-    geometry = df.apply(lambda row: shapely_Point(row.longitude, row.latitude, row.altitude_ft), axis=1)
+    df = df.sort_values('utc_datetime')
+    geometry = get_point_geometry(df.longitude, df.latitude, df.altitude_ft)
     gdf = gpd.GeoDataFrame(df, geometry=geometry)
-    gdf['diff_m'] = calc_distance_to_last_pt(gdf)
-    gdf['diff_seconds'] = gdf.utc_datetime.diff().dt.seconds
-    gdf.loc[gdf.diff_seconds.isnull() | (gdf.diff_seconds == 0) | (gdf.diff_seconds > (seg_time_diff * 60)), 'diff_seconds'] = -1
-    gdf['m_per_sec'] = gdf.diff_m / gdf.diff_seconds
-    if 'knots' not in gdf:
-        gdf['knots'] = (gdf.m_per_sec * M_PER_S_TO_KNOTS).fillna(-1).round().astype(int)# 1m/s == 1.94384 knots
-    gdf.loc[(gdf.knots < 0) | gdf.knots.isnull(), 'knots'] = 0
-
-    gdf['previous_lat'] = gdf.shift().latitude
-    gdf['previous_lon'] = gdf.shift().longitude
-    gdf['heading'] = gdf.apply(lambda row:
-                                    calc_bearing(*row[['previous_lat', 'previous_lon', 'latitude', 'longitude']]),
-                               axis=1)\
-        .fillna(-1).round().astype(int)
+    gdf = derive_kinematics(gdf, seg_time_diff)
 
     return gdf
 
 
-def parse_inreach_xml(parser, seg_time_diff=15):
-
-    points = []
-    for placemark in parser.find_all('Placemark'):
-        if placemark.find('kml:Point'):
-            points.append({d['name']: d.find('value').text for d in placemark.find_all('kml:Data') if d.find('value')})
+def parse_inreach_xml(path, seg_time_diff=15):
 
-    df = pd.DataFrame(points)
+    df = pd.DataFrame(kml_parser.InReachKMLParser().parse(path))
 
     df['ak_datetime'] = pd.to_datetime(df['Time'])
     df['utc_datetime'] = pd.to_datetime(df['Time UTC'])
@@ -305,78 +366,47 @@ def parse_inreach_xml(parser, seg_time_diff=15):
     df.latitude = df.latitude.astype(float)
     df['altitude_ft'] = df.elevation.str.extract(r'(\d*\.\d*)').astype(float) * FEET_PER_METER
 
-    geometry = df.apply(lambda row: shapely_Point(row.longitude, row.latitude, row.altitude_ft), axis=1)
+    geometry = get_point_geometry(df.longitude, df.latitude, df.altitude_ft)
     gdf = gpd.GeoDataFrame(df, geometry=geometry)
-    gdf['diff_m'] = calc_distance_to_last_pt(gdf)
-    gdf['diff_seconds'] = gdf.utc_datetime.diff().dt.seconds
-    gdf.loc[gdf.diff_seconds.isnull() | (gdf.diff_seconds == 0) | (gdf.diff_seconds > (seg_time_diff * 60)), 'diff_seconds'] = -1
-    gdf['m_per_sec'] = gdf.diff_m / gdf.diff_seconds
-    if 'knots' not in gdf:
-        gdf['knots'] = (gdf.m_per_sec * M_PER_S_TO_KNOTS).fillna(-1).round().astype(int)# 1m/s == 1.94384 knots
-    gdf.loc[(gdf.knots < 0) | gdf.knots.isnull(), 'knots'] = 0
-
-    gdf['previous_lat'] = gdf.shift().latitude
-    gdf['previous_lon'] = gdf.shift().longitude
-    gdf['heading'] = gdf.apply(lambda row:
-                                    calc_bearing(*row[['previous_lat', 'previous_lon', 'latitude', 'longitude']]),
-                               axis=1)\
-        .fillna(-1).round().astype(int)
+    gdf = derive_kinematics(gdf, seg_time_diff)
 
     return gdf
 
 
-def parse_flightradar_xml(parser, seg_time_diff):
-    points = []
-    placemarks = parser.find('Folder').find('name', text='Route').find_next_siblings('Placemark')
-    for placemark_ in  placemarks:
-        key_tags = bs4.BeautifulSoup(placemark_.description.text, 'xml').select('span > b')
-        content = {tag.text.strip(': '): tag.parent.find_next_sibling('span').text.strip() for tag in key_tags}
-
-        content['utc_datetime'] = pd.to_datetime(placemark_.select_one('TimeStamp > when').text)
-        point = placemark_.find('Point')
-        altitude_mode = point.find('altitudeMode').text 
-        if not altitude_mode == 'absolute':
-            raise RuntimeError(f'Altitude mode for this KML is {altitude_mode}, not absolute. Cannot determine actual altitude')
-        longitude, latitude, altitude = [c.strip() for c in point.find('coordinates').text.split(',')]
-        content['longitude'] = float(longitude)
-        content['latitude'] = float(latitude)
-        content['altitude_m'] = float(altitude)
-        
-        if 'Speed' in content:
-            try:
-                content['knots'] = float(re.match('\d*', content['Speed']).group()[0])
-            except:
-                pass
-        
-        if 'Heading' in content:
-            try:
-                content['heading'] = float(re.match('\d*', content['Heading']).group()[0])
-            except:
-                pass
-        points.append(content)
-
-    df = pd.DataFrame(points)
+def parse_flightradar_xml(path, seg_time_diff):
+
+    df = pd.DataFrame(kml_parser.FlightRadarKMLParser().parse(path))
+    df['utc_datetime'] = pd.to_datetime(df.utc_datetime)
     df['altitude_ft'] = df.altitude_m * FEET_PER_METER
-    geometry = df.apply(lambda row: shapely_Point(row.longitude, row.latitude, row.altitude_ft), axis=1)
+    geometry = get_point_geometry(df.longitude, df.latitude, df.altitude_ft)
     gdf = gpd.GeoDataFrame(df, geometry=geometry)
+    gdf = derive_kinematics(gdf, seg_time_diff)
+
+    return gdf
 
-    gdf['diff_m'] = calc_distance_to_last_pt(gdf)
-    gdf['diff_seconds'] = gdf.utc_datetime.diff().dt.seconds
-    gdf.loc[gdf.diff_seconds.isnull() | (gdf.diff_seconds == 0) | (gdf.diff_seconds > (seg_time_diff * 60)), 'diff_seconds'] = -1
-    gdf['m_per_sec'] = gdf.diff_m / gdf.diff_seconds
-    if 'knots' not in gdf:
-        gdf['knots'] = (gdf.m_per_sec * M_PER_S_TO_KNOTS).fillna(-1).round().astype(int)# 1m/s == 1.94384 knots
-    gdf.loc[(gdf.knots < 0) | gdf.knots.isnull(), 'knots'] = 0
 
-    gdf['previous_lat'] = gdf.shift().latitude
-    gdf['previous_lon'] = gdf.shift().longitude
+def read_foreflight_kml(path, seg_time_diff=15):
+    '''
+    Read track points from a Foreflight KML directly into a GeoDataFrame with the same columns as read_gpx() returns
+    '''
+    df = pd.DataFrame(kml_parser.ForeflightKMLParser().parse(path))
+
+    df['utc_datetime'] = pd.to_datetime(df.time)
+    df = df.loc[~df.utc_datetime.isna()].copy() # drop any points without a time
+
+    # Make points 3D
+    df['altitude_ft'] = (df.ele * FEET_PER_METER).astype(int)
+    gdf = gpd.GeoDataFrame(df, geometry=get_point_geometry(df.longitude, df.latitude, df.altitude_ft))
+
+    gdf.sort_values(by='utc_datetime', inplace=True)
+    gdf = derive_kinematics(gdf, seg_time_diff)
 
     return gdf
 
 
 def read_kml(path, seg_time_diff=15):
     '''
-    KMLs come in three accepted variants: Foreflight, FlightRadar, and Web Sentinel. If the file is of the Foreflight variant, convert KML to GPX, then just use read_gpx() function. Otherwise, parse the file and convert directly to a GeoDataframe.
+    KMLs come in four accepted variants: Foreflight, FlightRadar, InReach, and Web Sentinel. Each variant is parsed directly to a GeoDataframe.
     KML formats are:
         1. Foreflight:
             <Placemark>
@@ -408,44 +438,44 @@ def read_kml(path, seg_time_diff=15):
             ...
     '''
 
-    with open(path, encoding='utf-8') as f:
-        soup = bs4.BeautifulSoup(f, 'xml')
+    # Determine the variant from the start of the file and then parse it one Placemark at a time so the whole document
+    #   never has to be loaded into memory
+    kml_variant = kml_parser.sniff_kml_variant(path)
 
-    if soup.find('name', text='www.websentinel.net'):
+    if kml_variant == 'web_sentinel':
         try:
-            return parse_web_sentinel_xml(soup, seg_time_diff)
+            return parse_web_sentinel_xml(path, seg_time_diff)
         except Exception as e:
             raise RuntimeError('Could not parse Web Sentinel KML file %s: %s' % (path, e))
 
-    elif soup.find('kml:Data', attrs={'name': 'IMEI'}):
+    elif kml_variant == 'inreach':
         try:
-            return parse_inreach_xml(soup, seg_time_diff)
+            return parse_inreach_xml(path, seg_time_diff)
         except RuntimeError as e:
             raise RuntimeError('Could not process %s because %s' % (path, e))
         except Exception as e:
             raise RuntimeError('Could not parse InReach KML file %s: %s' % (path, e))
     
-    elif soup.find(lambda tag: tag.name == 'description' and 'www.flightradar24.com' in tag.text):
+    elif kml_variant == 'flightradar':
         try:
-            return parse_flightradar_xml(soup, seg_time_diff)
+            return parse_flightradar_xml(path, seg_time_diff)
         except Exception as e:
             raise RuntimeError('Could not parse Flight Radar KML file %s: %s' % (path, e))
 
-    elif soup.find('gx:Track'):
+    elif kml_variant == 'foreflight':
         try:
-            parser = kml_parser.ForeflightKMLParser()
-            gpx_path = parser.to_gpx(path, path.replace('.kml', '_from_kml.gpx'))
+            return read_foreflight_kml(path, seg_time_diff)
         except Exception as e:
             raise RuntimeError('Could not parse KML file %s from Foreflight format: %s' % (path, e))
-        return read_gpx(gpx_path, seg_time_diff)
     
     else:
         raise RuntimeError('Could not understand KML format of file %s' % path)
 
 
-def format_aff(path, encoding='ISO-8859-1', **kwargs):
+def format_aff(path, encoding='ISO-8859-1', data=None, **kwargs):
 
-    df = pd.read_csv(path, encoding=encoding)
+    data = get_csv_bytes(path, data)
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding)
     df.rename(columns=CSV_OUTPUT_COLUMNS['aff'], inplace=True)
 
     df.utc_datetime = pd.to_datetime(df.utc_datetime, errors='coerce')
@@ -453,38 +483,46 @@ def format_aff(path, encoding='ISO-8859-1', **kwargs):
     return df
 
 
-def dms_to_dd(degrees, minutes, seconds, direction):
-    ''' Convert coordinate in degrees minutes seconds to decimal degrees'''
-    decimal_degrees = float(degrees) + float(minutes)/60 + float(seconds)/(3600)
-
-    if direction in ['S', 'W']:
-        decimal_degrees *= -1
-
-    return decimal_degrees
+def parse_gsat_coordinate_column(coordinates):
+    '''
+    Parse a whole column of GSAT Lat/Lng strings into decimal degrees
 
+    :param coordinates: pd.Series of coordinate strings in the format 62°37'21.9600"N 150°44'42.0000"W. If the
+                        direction is missing, the coordinate is assumed to be positive (N or E)
+    :return: tuple of (latitude, longitude) pd.Series in decimal degrees. Rows that can't be parsed are NaN
+    '''
+    dms = coordinates.astype(str).str.extract(GSAT_COORDINATE_REGEX)
 
-def parse_gsat_coordinates(coordinates):
-    '''GSAT coordinates are in the format 62°37'21.9600"N 150°44'42.0000"W in a single Lat/Lng field'''
+    decimal_degrees = []
+    for axis in ('lat', 'lon'):
+        dd = pd.to_numeric(dms[axis + '_deg'], errors='coerce') + \
+             pd.to_numeric(dms[axis + '_min'], errors='coerce')/60 + \
+             pd.to_numeric(dms[axis + '_sec'], errors='coerce')/3600
+        decimal_degrees.append(dd.where(~dms[axis + '_dir'].isin(['S', 'W']), -dd))
 
-    # Make lists of [degress, min, sec, direction] for both lat and lon
-    lat_dms, lon_dms = [re.split('[°\'"]+', c) for c in coordinates.split()]
+    return tuple(decimal_degrees)
 
-    return dms_to_dd(*lat_dms), dms_to_dd(*lon_dms)
 
+def format_gsat(path, encoding='ISO-8859-1', skip_rows=0, data=None, **kwargs):
 
-def format_gsat(path, encoding='ISO-8859-1', skip_rows=0):
+    data = get_csv_bytes(path, data)
 
     # Try to get the registration number. It's stored in the third row, even though the metadata header is the first row
     try:
-        registration = 'N' + pd.read_csv(path, encoding=encoding).loc[2, 'Asset']
+        registration = 'N' + pd.read_csv(io.BytesIO(data), encoding=encoding, nrows=3).loc[2, 'Asset']
     except:
         registration = ''
 
-    df = pd.read_csv(path, encoding=encoding, skiprows=skip_rows)
-    for i in range(1, 6):
-        if 'lat/lng' in df.columns.str.lower():
+    # The metadata header is followed by the actual data header (with a Lat/Lng column) a few rows down, so find it
+    #   using just the start of the file and then parse the whole thing once
+    prefix = get_csv_prefix(data)
+    header_row = 5
+    for i in [skip_rows] + list(range(1, 5)):
+        columns = pd.read_csv(io.BytesIO(prefix), encoding=encoding, skiprows=i, nrows=0).columns
+        if 'lat/lng' in columns.str.lower():
+            header_row = i
             break
-        df = pd.read_csv(path, encoding=encoding, skiprows=i)
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding, skiprows=header_row)
     df.dropna(subset=['Lat/Lng'], inplace=True)
 
     #df = pd.read_csv(path, encoding='ISO-8859-1', skiprows=5)
@@ -493,7 +531,12 @@ def format_gsat(path, encoding='ISO-8859-1', skip_rows=0):
         df['registration'] = registration
 
     # Convert coordinates to separate decimal degree lat and lon fields
-    df['latitude'], df['longitude'] = list(zip(*df['Lat/Lng'].apply(parse_gsat_coordinates)))
+    df['latitude'], df['longitude'] = parse_gsat_coordinate_column(df['Lat/Lng'])
+    invalid_coordinates = df.latitude.isnull() | df.longitude.isnull()
+    if invalid_coordinates.any():
+        warnings.warn('Could not parse coordinates for %d of %d points in %s. These points will be ignored' %
+                      (invalid_coordinates.sum(), len(df), path))
+        df = df.loc[~invalid_coordinates].copy()
 
     # Remove "knots" in speed field
     df['knots'] = df['Speed'].astype(str).str.split(' ').str[0].astype(float)
@@ -515,14 +558,15 @@ def format_gsat(path, encoding='ISO-8859-1', skip_rows=0):
     # GSAT datetimes are in local time, so calculate UTC so that
     df['ak_datetime'] = pd.to_datetime(df['Date'], errors='coerce')
     timezone = pytz.timezone('US/Alaska')
-    df['utc_datetime'] = df.ak_datetime - df.ak_datetime.apply(timezone.utcoffset)
+    df['utc_datetime'] = df.ak_datetime - get_utc_offset(df.ak_datetime, timezone)
 
     return df
 
 
-def format_spy(path, encoding='ISO-8859-1', **kwargs):
+def format_spy(path, encoding='ISO-8859-1', data=None, **kwargs):
 
-    df = pd.read_csv(path, encoding=encoding)
+    data = get_csv_bytes(path, data)
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding)
 
     if 'Speed(mph)' in df:
         df['knots'] = df['Speed(mph)'] / 1.151
@@ -549,9 +593,10 @@ def format_spy(path, encoding='ISO-8859-1', **kwargs):
     return df
 
 
-def format_tms(path, encoding='ISO-8859-1', **kwargs):
+def format_tms(path, encoding='ISO-8859-1', data=None, **kwargs):
 
-    df = pd.read_csv(path, encoding=encoding)
+    data = get_csv_bytes(path, data)
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding)
 
     # some of the time TMS columns names have spaces on either end
     df.columns = df.columns.str.strip()
@@ -577,19 +622,20 @@ def format_tms(path, encoding='ISO-8859-1', **kwargs):
     return df
 
 
-def format_foreflight_csv(path, encoding='ISO-8859-1', **kwargs):
+def format_foreflight_csv(path, encoding='ISO-8859-1', data=None, **kwargs):
 
+    data = get_csv_bytes(path, data)
     try:
-        registration = pd.read_csv(path, encoding=encoding, nrows=5).loc[0, 'Tail Number']
+        registration = pd.read_csv(io.BytesIO(get_csv_prefix(data)), encoding=encoding, nrows=5).loc[0, 'Tail Number']
     except:
         registration = ''
-    df = pd.read_csv(path, encoding=encoding, skiprows=2)
+    df = pd.read_csv(io.BytesIO(data), encoding=encoding, skiprows=2)
     df['registration'] = registration
 
     # Timestamp are in local time. The rest of the read functions all return UTC time, so calcualte that, even though
-    #   the local time will just be calculated later
-    epoch_datetime = datetime(1970, 1, 1)
-    df['utc_datetime'] = pd.to_datetime([epoch_datetime + timedelta(seconds=round(ts/1000)) for ts in df['Timestamp']])
+    #   the local time will just be calculated later. Timestamps are milliseconds since the epoch, so round to the
+    #   nearest second
+    df['utc_datetime'] = pd.to_datetime((df['Timestamp'] / 1000).round(), unit='s')
 
     # Convert altitude meters to feet
     df['altitude_ft'] = (df['Altitude'] * FEET_PER_METER).astype(int)
@@ -606,30 +652,76 @@ def format_foreflight_csv(path, encoding='ISO-8859-1', **kwargs):
 
 def read_excel(path):
     """
-    Wrapper for read_csv() (after converting Excel file to CSV)
+    Wrapper for read_csv() (after converting Excel file to CSV in memory)
     :param path: Excel track
     :return: GeoDataFrame of the track file
     """
     df = pd.read_excel(path)
-    _, ext = os.path.splitext(path)
-    csv_path = path.replace(ext, '.csv')
-    df.to_csv(csv_path, index=False)
 
-    return read_csv(csv_path)
+    return read_csv(path, data=df.to_csv(index=False).encode('utf-8'))
 
 
-def get_csv_type(path, encoding):
+def get_csv_bytes(path, data=None):
+    """
+    Helper function to get the raw contents of a CSV, only reading the file if it hasn't already been read
+    :param path: path to the CSV
+    :param data: bytes already read from path, if any
+    :return: bytes
+    """
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+    return data
+
+
+def get_csv_prefix(data, n_bytes=CSV_SNIFF_BYTES):
+    """
+    Helper function to get the first n_bytes of a CSV, trimmed to the last complete line
+    :param data: bytes of the CSV
+    :param n_bytes: maximum number of bytes to return
+    :return: bytes
+    """
+    if len(data) <= n_bytes:
+        return data
+    prefix = data[:n_bytes]
+    last_line_end = prefix.rfind(b'\n')
+
+    return prefix[:last_line_end + 1] if last_line_end > 0 else prefix
+
+
+def detect_encoding(data, n_bytes=CSV_SNIFF_BYTES):
+    """
+    Helper function to guess the encoding of a CSV from (at most) its first n_bytes
+    :param data: bytes of the CSV
+    :param n_bytes: maximum number of bytes to feed to the detector
+    :return: name of the encoding
+    """
+    detector = chardet.universaldetector.UniversalDetector()
+    for line in data[:n_bytes].splitlines(keepends=True):
+        detector.feed(line)
+        if detector.done:
+            break
+    detector.close()
+
+    # Get the encoding even if the detector doesn't have high confidence
+    return detector.result['encoding']
+
+
+def get_csv_type(path, encoding, data=None):
     """
     Helper function to try to determine the CSV source
     :param path:
     :param encoding:
+    :param data: bytes already read from path, if any. Only the start of the file is used
     :return:
     """
+    prefix = get_csv_prefix(get_csv_bytes(path, data))
     column_match_scores = pd.Series([0])
     skip_rows = 0
     best_match = None
     while skip_rows < 10:
-        df = pd.read_csv(path, encoding=encoding, nrows=2, skiprows=skip_rows)
+        df = pd.read_csv(io.BytesIO(prefix), encoding=encoding, nrows=2, skiprows=skip_rows)
         df.columns = df.columns.str.strip()
         # Figure out which file type it is (aff, gsat, spy, or tms) by selecting the file type that most closely matches
         #   the expected columns per type
@@ -652,29 +744,20 @@ def get_csv_type(path, encoding):
     return best_match, skip_rows
 
 
-def read_csv(path, seg_time_diff=None):
+def read_csv(path, seg_time_diff=None, data=None):
     """
     Read and format a CSV of track data. CSVs can come from 4 different sources, so figure out which source it comes
-    from and format accordingly
+    from and format accordingly. The file is only read once: the encoding, header row, and source are all determined
+    from the start of the file in memory and the same bytes are then parsed
 
     :param path: path to track CSV
+    :param data: [optional] contents of the CSV if they were already read (or converted from another format)
     :return: GeoDataframe of points
     """
+    data = get_csv_bytes(path, data)
+
     # Try to determine the file's encoding
-    detector = chardet.universaldetector.UniversalDetector()
-    encoding = ''
-    with open(path, 'rb') as f:
-        for line in f.readlines():
-            detector.feed(line)
-            if detector.done:
-                encoding = detector.result['encoding']
-                break
-    
-    detector.close()
-    # Get the encoding even if the detector doesn't have high confidence
-    encoding = detector.result['encoding']
-        #raise RuntimeError('Could not determine encoding of file ' + path)
-    
+    encoding = detect_encoding(data)
 
     CSV_FUNCTIONS = {'aff': format_aff,
                      'gsat': format_gsat,
@@ -683,7 +766,7 @@ def read_csv(path, seg_time_diff=None):
                      'foreflight': format_foreflight_csv
                      }
 
-    best_match, skip_rows = get_csv_type(path, encoding)
+    best_match, skip_rows = get_csv_type(path, encoding, data=data)
     
     if not best_match in CSV_FUNCTIONS:
         sorted_types = sorted(CSV_FUNCTIONS.keys())
@@ -692,12 +775,12 @@ def read_csv(path, seg_time_diff=None):
             ('Only %s, and %s currently accepted.' % (', '.join(sorted_types[:-1]), sorted_types[-1]))
         )
 
-    df = CSV_FUNCTIONS[best_match](path, encoding, skip_rows=skip_rows)
+    df = CSV_FUNCTIONS[best_match](path, encoding, skip_rows=skip_rows, data=data)
     df.heading = df.heading.round().astype(int)
     df.knots = df.knots.round().astype(int)
 
     # Make the dataframe into a geodataframe of points
-    geometry = df.apply(lambda row: shapely_Point(row.longitude, row.latitude, row.altitude_ft), axis=1)
+    geometry = get_point_geometry(df.longitude, df.latitude, df.altitude_ft)
     gdf = gpd.GeoDataFrame(df, geometry=geometry)
     gdf['diff_m'] = calc_distance_to_last_pt(gdf)
 
@@ -737,31 +820,41 @@ READ_FUNCTIONS = {'.gpx': read_gpx,
                   }
 
 
-def check_duplicate_flights(registration, connection, start_time, end_time):
+def find_duplicate_flights(flights, connection, use_flight_extents=False):
     """
-    Check whether an aircraft with this registration has been recorded in the DB for any time within a given start and
-    end time
+    Check whether any of the aircraft in flights have been recorded in the DB at any time within the start and end
+    time of each flight segment using a single query. The registrations, start times, and end times of all flights are
+    sent as arrays and unnested into rows on the server, so the SQL doesn't grow with the number of flight segments.
 
-    :param registration: Tail (N-) number for this flight
+    :param flights: pd.DataFrame of flight segments with registration, departure_datetime, and end_datetime columns
     :param connection: SQLAlchemy DB connection (from engine.connect()) pointing to postgres backend overflights DB
-    :param start_time: starting time for this flight
-    :param end_time: ending time for this flight
-    :return: pd.DataFrame of matching flight points
+    :param use_flight_extents: if True, compare each segment to the departure and landing times of existing flights
+                               rather than searching for individual points within the segment's time range. This is
+                               much faster because it doesn't scan flight_points, but it will miss matches if an
+                               existing flight's departure or landing time was edited
+    :return: pd.DataFrame of matching flights
     """
+    if use_flight_extents:
+        time_criteria = "flights.departure_datetime <= candidates.end_time AND " \
+                        "flights.landing_datetime >= candidates.start_time"
+    else:
+        time_criteria = "EXISTS (" \
+                        "SELECT 1 FROM flight_points WHERE flight_points.flight_id = flights.id AND " \
+                        "flight_points.ak_datetime BETWEEN candidates.start_time AND candidates.end_time)"
+
     sql = """
     SELECT flights.* 
-    FROM flight_points 
-    INNER JOIN flights ON flight_points.flight_id = flights.id
-    WHERE
-        flight_points.ak_datetime BETWEEN '{start_time}' AND '{end_time}' AND
-        flights.registration = '{registration}'
-    """\
-        .format(start_time=start_time.strftime('%Y-%m-%d %H:%M'),
-                end_time=end_time.strftime('%Y-%m-%d %H:%M'),
-                registration=registration)
-
-    #with engine.connect() as conn, conn.begin():
-    matching_flights = pd.read_sql(sql, connection).drop_duplicates(subset=['registration', 'departure_datetime'])
+    FROM unnest(CAST(:registrations AS text[]), CAST(:start_times AS timestamp[]), CAST(:end_times AS timestamp[])) 
+        AS candidates(registration, start_time, end_time)
+    INNER JOIN flights ON flights.registration = candidates.registration
+    WHERE {time_criteria}
+    """.format(time_criteria=time_criteria)
+
+    params = {'registrations': flights.registration.tolist(),
+              'start_times': flights.departure_datetime.dt.strftime('%Y-%m-%d %H:%M').tolist(),
+              'end_times': flights.end_datetime.dt.strftime('%Y-%m-%d %H:%M').tolist()}
+    matching_flights = pd.read_sql(sqlalchemy_text(sql), connection, params=params)\
+        .drop_duplicates(subset=['registration', 'departure_datetime'])
 
     return matching_flights
 
@@ -817,7 +910,7 @@ def format_track(path, seg_time_diff=15, min_point_distance=200, registration=''
         if gdf.utc_datetime.dt.tz:
             gdf['ak_datetime'] = gdf.utc_datetime.dt.tz_convert(timezone)
         else: # otherwise, calculate by adding the offset
-            gdf['ak_datetime'] = gdf.utc_datetime + gdf.utc_datetime.apply(timezone.utcoffset)
+            gdf['ak_datetime'] = gdf.utc_datetime + get_utc_offset(gdf.utc_datetime, timezone)
     # track points are *usually* in chronological order, but not always Also some files have duplicated track points for
     #   some reason, so get rid of those. Resetting the index is important if this function is being called from 
     #   poll_feature_service.py. The index is used to create a point_index field, which the track-editor app needs
@@ -881,7 +974,7 @@ def format_track(path, seg_time_diff=15, min_point_distance=200, registration=''
     return gdf
 
 
-def import_data(connection_txt=None, data=None, path=None, seg_time_diff=15, min_point_distance=200, registration='', submission_method='manual', operator_code=None, aircraft_type=None, silent=False, force_import=False, ssl_cert_path=None, engine=None, force_registration=False, ignore_duplicate_flights=False, **kwargs):
+def import_data(connection_txt=None, data=None, path=None, seg_time_diff=15, min_point_distance=200, registration='', submission_method='manual', operator_code=None, aircraft_type=None, silent=False, force_import=False, ssl_cert_path=None, engine=None, force_registration=False, ignore_duplicate_flights=False, use_flight_extents=False, **kwargs):
 
 
     if type(data) == gpd.geodataframe.GeoDataFrame:
@@ -923,28 +1016,32 @@ def import_data(connection_txt=None, data=None, path=None, seg_time_diff=15, min
     if not len(flights):
         raise ValueError('No flight segments found in this file.')
 
+    # Serialize geometries as hex WKB all at once so they can be bulk loaded with COPY
     points = gdf.copy()
-    points['geom'] = gdf.geometry.apply(lambda g: WKTElement(g.wkt, srid=4326))
+    points['geom'] = gdf.geometry.to_wkb(hex=True)
     points.drop(columns=points.columns[~points.columns.isin(point_columns)], inplace=True)
 
     line_geom = gdf.groupby('flight_id').geometry.apply(lambda g: shapely_LineString(g.to_list()))
     lines = gpd.GeoDataFrame(flights.set_index('flight_id'), geometry=line_geom)
-    lines['geom'] = lines.geometry.apply(lambda g: WKTElement(g.wkt, srid=4326))
+    lines['geom'] = lines.geometry.to_wkb(hex=True)
     lines['flight_id'] = lines.index
     lines.drop(columns=lines.columns[~lines.columns.isin(line_columns)], inplace=True)
     lines.index.name = None
 
+    # If flight_points has been partitioned with partition_flight_points.py, make sure the partitions for these points
+    #   exist before starting the import transaction. Postgres routes each row to its partition, so the COPY itself
+    #   doesn't change
+    points_tables = partition_flight_points.prepare_partitions(engine, points.ak_datetime) or ['flight_points']
+
     with engine.connect() as conn, conn.begin():
 
         # Insert only new flights. Check for new flights by looking for flight points from the same registration number
         #   that are within the start and end times of each flight segment (since an aircraft can't be in 2 locations
         #   at the same time).
-        existing_flight_info = []
-        existing_flight_ids = []
-        for _, f in flights.iterrows():
-            matching_flights = check_duplicate_flights(f.registration, conn, f.departure_datetime, f.end_datetime)
-            existing_flight_info.extend([(m.registration, m.departure_datetime) for _, m in matching_flights.iterrows()])
-            existing_flight_ids.extend(matching_flights.flight_id)
+        #   All segments are checked with a single query
+        matching_flights = find_duplicate_flights(flights, conn, use_flight_extents=use_flight_extents)
+        existing_flight_info = list(zip(matching_flights.registration, matching_flights.departure_datetime))
+        existing_flight_ids = matching_flights.flight_id.tolist()
         if len(existing_flight_info) and not force_import and not ignore_duplicate_flights:
             existing_str = '\n\t-'.join(['%s: %s' % f for f in existing_flight_info])
             raise ValueError('The file {path} contains flight segments that already exist in the database as'
@@ -953,9 +1050,12 @@ def import_data(connection_txt=None, data=None, path=None, seg_time_diff=15, min
                              ' the --force_import flag (ONLY USE THIS FLAG IF YOU KNOW WHAT YOU\'RE DOING).'
                              .format(path=path, existing_flights=existing_str))
 
+        # INSERT the new flights and get the numeric IDs that were generated for them
         new_flights = flights.loc[~flights.flight_id.isin(existing_flight_ids)]
-        new_flights.drop(columns='end_datetime')\
-            .to_sql('flights', conn, if_exists='append', index=False)
+        flight_ids = db_utils.insert_returning(new_flights.drop(columns='end_datetime'),
+                                               'flights',
+                                               conn,
+                                               returning=['id', 'flight_id'])
 
         # Warn the user if any of the flights already exist
         n_flights = len(flights)
@@ -973,46 +1073,48 @@ def import_data(connection_txt=None, data=None, path=None, seg_time_diff=15, min
                                       )
                               )
 
-        # Get the numeric IDs of the flights that were just inserted and insert the points and lines matching those
-        #   flight IDs that were just inserted
-        flight_ids = pd.read_sql("SELECT id, flight_id FROM flights WHERE flight_id IN ('%s')"
-                                 % "', '".join(flights.flight_id),
-                                 conn)
+        # Insert the points and lines matching the flight IDs that were just inserted. Points and lines are loaded with
+        #   COPY on the same connection, so they're part of the same transaction as the flights INSERT
         points = points.merge(flight_ids, on='flight_id')
-        points.loc[~points.flight_id.isin(existing_flight_ids)]\
+        new_points = points.loc[~points.flight_id.isin(existing_flight_ids)]\
             .drop('flight_id', axis=1) \
-            .rename(columns={'id': 'flight_id'})\
-            .to_sql('flight_points',
-                    conn,
-                    if_exists='append',
-                    index=False,
-                    dtype={'geom': Geometry('POINT Z', srid=4326)})
+            .rename(columns={'id': 'flight_id'})
+        db_utils.copy_to_table(pd.DataFrame(new_points), 'flight_points', conn)
         lines = lines.merge(flight_ids, on='flight_id')
-        lines.loc[~lines.flight_id.isin(existing_flight_ids)]\
+        new_lines = lines.loc[~lines.flight_id.isin(existing_flight_ids)]\
             .drop('flight_id', axis=1) \
-            .rename(columns={'id': 'flight_id'})\
-            .to_sql('flight_lines',
-                    conn,
-                    if_exists='append',
-                    index=False,
-                    dtype={'geom': Geometry('LineStringZ', srid=4326)})
+            .rename(columns={'id': 'flight_id'})
+        db_utils.copy_to_table(pd.DataFrame(new_lines), 'flight_lines', conn)
+
+        # Summarize the new flights in the same transaction so the summary tables (if they've been created with
+        #   track_summaries.py) are always in sync with the points and lines. Check for the tables without the cached
+        #   table list in case they were created after this process started
+        if track_summaries.summary_tables_exist(conn, ttl=0):
+            track_summaries.update_summaries(conn, flight_ids.id)
+        # Likewise, store simplified versions of the new lines for low-resolution queries (see simplify_lines.py)
+        if simplify_lines.simplified_table_exists(conn, ttl=0):
+            simplify_lines.update_simplified_lines(conn, flight_ids.id)
 
         # INSERT info about this aircraft if it doesn't already exist. If it does, UPDATE it if necessary
         #   disable because this happens now as a separate scheduled task
         if ssl_cert_path:
             ainfo.update_aircraft_info(conn, registration, ssl_cert_path)#'''
 
-    # VACUUM and ANALYZE clean up unused space and recalculate statistics to improve spatial query performance. Attempt
-    #   to run these commands on both spatial tables, but if they fail, just warn the user since it's not that big of
-    #   a deal
+    # VACUUM and ANALYZE clean up unused space and recalculate statistics to improve spatial query performance, but
+    #   running them on the full tables after every import gets slower as the tables grow. Only maintain the tables
+    #   once enough rows have changed (across all imports, not just this one) or when db_utils.run_maintenance() is
+    #   called at the end of a batch. Each partition of flight_points is maintained separately, so only the partitions
+    #   that changed are checked
+    db_utils.maintain_changed_tables(engine, ['flights', 'flight_lines'] + points_tables)
+
+    # Remove any cached query results that might include these flights. The cache directory is resolved now (not when
+    #   query_cache was imported), so pointing the FLIGHTSDB_QUERY_CACHE_DIR environment variable at a shared directory
+    #   invalidates the cache that every user reads from
     try:
-        with engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
-            conn.execute('VACUUM ANALYZE flight_points;')
-            conn.execute('VACUUM ANALYZE flight_lines;')
-    except:
-        warnings.warn("Unable to VACUUM and ANALYZE geometry tables. You should connect to the database and manually"
-                      " run 'VACUUM ANALYZE flight_points' and 'VACUUM ANALYZE flight_lines;' to ensure queries are as"
-                      " effecient as possible")
+        query_cache.invalidate(new_flights.departure_datetime.min(), new_flights.end_datetime.max())
+    except Exception as e:
+        warnings.warn('Could not invalidate cached query results because %s. You should delete the cache directory %s'
+                      % (e, query_cache.get_cache_dir()))
 
     # Archive the data file
     if not os.path.isdir(ARCHIVE_DIR):
@@ -1062,6 +1164,9 @@ def main(connection_txt, track_path, seg_time_diff=15, min_point_distance=200, r
     try:
         import_data(connection_txt, path=track_path, seg_time_diff=seg_time_diff, min_point_distance=min_point_distance, registration=registration, submission_method=submission_method, operator_code=operator_code,
                       aircraft_type=aircraft_type, force_import=force_import, ssl_cert_path=ssl_cert_path)
+        # Only one file was imported, so a full VACUUM isn't worth it, but the query planner should know about the new
+        #   rows
+        db_utils.run_maintenance(db_utils.connect_db(connection_txt), vacuum=False)
     except Exception as e:
         if email_credentials_txt:
             message_body = '''There was a problem with the attached file: %s'''
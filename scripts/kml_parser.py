@@ -1,88 +1,387 @@
 import os
+import re
+import bs4
 import xml.sax
 
 
+# Patterns that identify each KML variant in order of precedence (i.e., if more than one matches, the first one wins)
+KML_VARIANT_PATTERNS = [
+    ('web_sentinel', re.compile(r'<name>\s*www\.websentinel\.net\s*</name>')),
+    ('inreach', re.compile(r'<(?:\w+:)?Data\s+name=["\']IMEI["\']')),
+    ('flightradar', re.compile(r'www\.flightradar24\.com')),
+    ('foreflight', re.compile(r'<gx:Track[\s>]'))
+]
+
+
 class ForeflightKMLParser(xml.sax.ContentHandler):
     '''
     Adapted from https://gist.github.com/timabell/8791116
 
+    Retrieve the track points as a dictionary of {column_name: [values]} that can be passed directly to pd.DataFrame()
+    like
+    columns = ForeflightKMLParser().parse(kml_file_path)
+
+    Columns are longitude, latitude, ele (meters), time (unparsed string), and track_seg_id. Each <gx:Track> is a
+    separate segment, and each <when> is matched to the <gx:coord> at the same position within its <gx:Track>.
+
     Retrieve an OGR readable GPX string like
-    gpx_string = KMLParser().parse(kml_file_path)
+    gpx_string = ForeflightKMLParser().get_gpx_string(kml_file_path)
 
     Convert the KML directly to a gpx file like
-    KMLParser().to_gpx(kml_path, gpx_path)
+    ForeflightKMLParser().to_gpx(kml_path, gpx_path)
     
     '''
 
     def __init__(self):
         self.in_tag = 0
-        self.chars = ""
-        self.when = ""
-        self.started = 0
-        self._gpx_string = \
-            '<?xml version="1.0" encoding="UTF-8"?>\n' \
-            '<gpx version="1.0"\n' \
-                '\txmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n' \
-                '\tcreator="%s (adapted from https://gist.github.com/timabell/8791116)"\n' % __file__ +\
-                '\txmlns="http://www.topografix.com/GPX/1/0"\n' \
-                '\txsi:schemaLocation="http://www.topografix.com/GPX/1/0 http://www.topografix.com/GPX/1/0/gpx.xsd">\n' \
-            '\t<trk>\n' \
-            '\t\t<trkseg>\n'
+        self.in_track = 0
+        self.chars = []
+        self.track_whens = []
+        self.track_coords = []
+        self.n_tracks = 0
+        self.columns = {'longitude': [], 'latitude': [], 'ele': [], 'time': [], 'track_seg_id': []}
 
     def startElement(self, name, attrs):
-        if name == "gx:coord":
+        if name == "gx:Track":
+            self.in_track = 1
+            self.track_whens = []
+            self.track_coords = []
+        if name == "gx:coord" and self.in_track:
             self.in_tag = 1
-            self.chars = ""
-        if name == "when":
+            self.chars = []
+        if name == "when" and self.in_track:
             self.in_tag = 1
-            self.chars = ""
-        if name == "gx:Track" and self.started:
-            self._gpx_string += '\t\t</trkseg>\n'
-            self._gpx_string += '\t\t<trkseg>\n'
+            self.chars = []
 
 
     def characters(self, char):
         if self.in_tag:
-            self.chars += char
+            self.chars.append(char)
 
 
     def endElement(self, name):
-        if name == "when":
-            self.in_coord=0
-            self.when = self.chars
-            self.chars=""
-        if name == "gx:coord":
-            self.in_coord = 0
-            self.started = 1
-            coords=self.chars
-            self.chars = ""
-            coords = coords.split()
-            self._gpx_string += '\t\t\t<trkpt lat="%s" lon="%s">\n' % (coords[1],coords[0])
-            if len(coords) > 2:
-                self._gpx_string += '\t\t\t\t<ele>%s</ele>\n' % coords[2]
-            self._gpx_string += '\t\t\t\t<time>%s</time>\n' % self.when
-            self._gpx_string += "\t\t\t</trkpt>\n"
-
-
-    def close_gpx(self):
-        self._gpx_string += '\t\t</trkseg>\n\t</trk>\n</gpx>\n'
+        if name == "when" and self.in_tag:
+            self.in_tag = 0
+            self.track_whens.append(''.join(self.chars).strip())
+        if name == "gx:coord" and self.in_tag:
+            self.in_tag = 0
+            self.track_coords.append(''.join(self.chars).split())
+        if name == "gx:Track":
+            self.in_track = 0
+            self.end_track()
+
+
+    def end_track(self):
+        n_whens = len(self.track_whens)
+        for i, coords in enumerate(self.track_coords):
+            self.columns['longitude'].append(float(coords[0]))
+            self.columns['latitude'].append(float(coords[1]))
+            self.columns['ele'].append(float(coords[2]) if len(coords) > 2 else None)
+            self.columns['time'].append(self.track_whens[i] if i < n_whens else None)
+            self.columns['track_seg_id'].append(self.n_tracks)
+        self.n_tracks += 1
+        self.track_whens = []
+        self.track_coords = []
 
 
     def parse(self, f):
         xml.sax.parse(f, self)
-        self.close_gpx()
 
-        return self._gpx_string
+        return self.columns
+
+
+    def get_gpx_string(self, f=None):
+        '''Make a GPX string from the parsed track points, parsing the KML file f first if given'''
+        if f:
+            self.parse(f)
+
+        gpx_lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.0"\n'
+                '\txmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                '\tcreator="%s (adapted from https://gist.github.com/timabell/8791116)"\n' % __file__ +\
+                '\txmlns="http://www.topografix.com/GPX/1/0"\n'
+                '\txsi:schemaLocation="http://www.topografix.com/GPX/1/0 http://www.topografix.com/GPX/1/0/gpx.xsd">\n'
+            '\t<trk>\n'
+        ]
+        columns = self.columns
+        last_segment = None
+        for i, segment in enumerate(columns['track_seg_id']):
+            if segment != last_segment:
+                if last_segment is not None:
+                    gpx_lines.append('\t\t</trkseg>\n')
+                gpx_lines.append('\t\t<trkseg>\n')
+                last_segment = segment
+            gpx_lines.append('\t\t\t<trkpt lat="%s" lon="%s">\n' % (columns['latitude'][i], columns['longitude'][i]))
+            if columns['ele'][i] is not None:
+                gpx_lines.append('\t\t\t\t<ele>%s</ele>\n' % columns['ele'][i])
+            gpx_lines.append('\t\t\t\t<time>%s</time>\n' % columns['time'][i])
+            gpx_lines.append('\t\t\t</trkpt>\n')
+        if last_segment is not None:
+            gpx_lines.append('\t\t</trkseg>\n')
+        gpx_lines.append('\t</trk>\n</gpx>\n')
+
+        return ''.join(gpx_lines)
 
 
     def to_gpx(self, kml_path, gpx_path=None):
-        self.parse(kml_path)
+        gpx_string = self.get_gpx_string(kml_path)
         if not gpx_path:
             _, extension = os.path.splitext(kml_path)
             gpx_path = kml_path.rstrip(extension) + '.gpx'
             if os.path.isfile(gpx_path):
                 raise IOError('default gpx_path already exists: %s. Specify a different path to write the GPX to' % gpx_path)
         with open(gpx_path, 'w') as gpx:
-            gpx.write(self._gpx_string)
+            gpx.write(gpx_string)
+
+        return gpx_path
+
+
+def sniff_kml_variant(path, chunk_size=8192):
+    '''
+    Determine which variant of KML a file is from the first few KB of the file. If none of the identifying patterns are
+    found there, keep reading the file one chunk at a time so memory use doesn't grow with the size of the file.
+
+    :param path: path to the KML file
+    :param chunk_size: number of bytes to read at a time
+    :return: 'web_sentinel', 'inreach', 'flightradar', 'foreflight', or None if the variant couldn't be determined
+    '''
+    # Keep the end of the last chunk in case a pattern straddles 2 chunks
+    overlap = 256
+    tail = ''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return None
+            text = tail + chunk.decode('utf-8', errors='ignore')
+            for variant, pattern in KML_VARIANT_PATTERNS:
+                if pattern.search(text):
+                    return variant
+            tail = text[-overlap:]
+
+
+class StreamingKMLParser(xml.sax.ContentHandler):
+    '''
+    Base class for parsing KML Placemarks one at a time into columns without ever loading the whole document into
+    memory. Subclasses collect whatever they need from each Placemark's elements in end_placemark_element() and add a
+    row with add_row() in end_placemark().
+
+    Get a dictionary of {column_name: [values]} that can be passed directly to pd.DataFrame() like
+    columns = WebSentinelKMLParser().parse(kml_path)
+
+    Element names are compared without namespace prefixes, so <kml:Data> and <Data> are treated the same
+    '''
+
+    def __init__(self):
+        self.element_path = []
+        self.chars = []
+        self.placemark = None
+        self.columns = {}
+        self.n_rows = 0
+
+
+    @staticmethod
+    def local_name(name):
+        return name.split(':')[-1]
+
+
+    def startElement(self, name, attrs):
+        name = self.local_name(name)
+        self.element_path.append(name)
+        self.chars = []
+        if name == 'Placemark':
+            self.placemark = {}
+            self.start_placemark()
+        elif self.placemark is not None:
+            self.start_placemark_element(name, attrs)
+
+
+    def characters(self, char):
+        self.chars.append(char)
+
+
+    def endElement(self, name):
+        name = self.local_name(name)
+        text = ''.join(self.chars)
+        self.chars = []
+        self.element_path.pop()
+        if name == 'Placemark':
+            self.end_placemark()
+            self.placemark = None
+        elif self.placemark is not None:
+            self.end_placemark_element(name, text)
+        else:
+            self.end_element(name, text)
+
+
+    def start_placemark(self):
+        pass
+
+
+    def start_placemark_element(self, name, attrs):
+        pass
+
+
+    def end_placemark_element(self, name, text):
+        pass
+
+
+    def end_placemark(self):
+        pass
+
+
+    def end_element(self, name, text):
+        pass
+
+
+    def add_row(self, row):
+        '''Append a dictionary of values to the columns, filling any column not in row with None'''
+        for column_name in row:
+            if column_name not in self.columns:
+                self.columns[column_name] = [None] * self.n_rows
+        for column_name, values in self.columns.items():
+            values.append(row.get(column_name))
+        self.n_rows += 1
+
+
+    def parse(self, f):
+        xml.sax.parse(f, self)
+
+        return self.columns
+
+
+class WebSentinelKMLParser(StreamingKMLParser):
+    '''
+    Parse waypoint Placemarks from a Web Sentinel KML. Each point's description is split into key: value pairs, which
+    become columns along with latitude, longitude, altitude_ft, and (if given) knots
+    '''
+
+    def end_placemark_element(self, name, text):
+        if name in ('styleUrl', 'description', 'coordinates'):
+            self.placemark[name] = text
+
+
+    def end_placemark(self):
+        if self.placemark.get('styleUrl', '').strip() != '#waypt':
+            return
+
+        if not self.placemark.get('description'):
+            raise ValueError('No description for point in KML file')
+        content = {
+            k.strip(): v.strip() for k, v in
+            [
+                [j for j in i.split(':', 1)]
+                for i in self.placemark['description'].split('\n')
+                if ':' in i
+            ]
+        }
+        if not self.placemark.get('coordinates'):
+            raise ValueError('No coordinates for point in KML file')
+        coordinates = [c.strip() for c in self.placemark['coordinates'].split(',')]
+        content['latitude'] = float(coordinates[1])
+        content['longitude'] = float(coordinates[0])
+        if len(coordinates) > 2:
+            content['altitude_ft'] = float(coordinates[2])
+        elif 'Feet' in content:
+            content['altitude_ft'] = float(content['Feet'])
+        else:
+            raise RuntimeError('No altitude value for point in KML file:\n%s' % self.placemark['description'])
+
+        if 'Knots' in content:
+            content['knots'] = float(content['Knots'])
+
+        self.add_row(content)
+
+
+class InReachKMLParser(StreamingKMLParser):
+    '''
+    Parse point Placemarks from a Garmin InReach KML. Each <Data name="..."><value>...</value></Data> element becomes a
+    column. Empty <value/> elements are skipped so those columns are null rather than empty strings
+    '''
+
+    def start_placemark(self):
+        self.has_point = False
+        self.data_name = None
+
+
+    def start_placemark_element(self, name, attrs):
+        if name == 'Data':
+            self.data_name = attrs.get('name')
+
+
+    def end_placemark_element(self, name, text):
+        if name == 'value' and self.element_path[-1] == 'Data' and self.data_name is not None:
+            if text:
+                self.placemark[self.data_name] = text
+        elif name == 'Data':
+            self.data_name = None
+        elif name == 'Point':
+            self.has_point = True
+
+
+    def end_placemark(self):
+        if self.has_point:
+            self.add_row(self.placemark)
+
+
+class FlightRadarKMLParser(StreamingKMLParser):
+    '''
+    Parse the Placemarks that follow the <name>Route</name> element of a FlightRadar24 KML. The HTML in each
+    description is parsed into key: value pairs, which become columns along with utc_datetime (as an unparsed string),
+    longitude, latitude, altitude_m, and (if given) knots and heading
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.route_depth = None
+        self.in_route = False
+
+
+    def start_placemark(self):
+        # Only Placemarks that are siblings of the Route name element are part of the track
+        self.in_route = self.route_depth is not None and len(self.element_path) - 1 == self.route_depth
+
+
+    def end_element(self, name, text):
+        if name == 'name' and text.strip() == 'Route' and self.route_depth is None and 'Folder' in self.element_path:
+            self.route_depth = len(self.element_path)
+        elif self.route_depth is not None and len(self.element_path) < self.route_depth:
+            # The parent of the Route name element was closed
+            self.route_depth = -1
+
+
+    def end_placemark_element(self, name, text):
+        if name in ('description', 'when', 'altitudeMode', 'coordinates'):
+            self.placemark[name] = text
+
+
+    def end_placemark(self):
+        if not self.in_route:
+            return
+
+        key_tags = bs4.BeautifulSoup(self.placemark['description'], 'xml').select('span > b')
+        content = {tag.text.strip(': '): tag.parent.find_next_sibling('span').text.strip() for tag in key_tags}
+
+        content['utc_datetime'] = self.placemark['when'].strip()
+        altitude_mode = self.placemark['altitudeMode'].strip()
+        if not altitude_mode == 'absolute':
+            raise RuntimeError(f'Altitude mode for this KML is {altitude_mode}, not absolute. Cannot determine actual altitude')
+        longitude, latitude, altitude = [c.strip() for c in self.placemark['coordinates'].split(',')]
+        content['longitude'] = float(longitude)
+        content['latitude'] = float(latitude)
+        content['altitude_m'] = float(altitude)
+
+        if 'Speed' in content:
+            try:
+                content['knots'] = float(re.match('\d*', content['Speed']).group()[0])
+            except:
+                pass
+
+        if 'Heading' in content:
+            try:
+                content['heading'] = float(re.match('\d*', content['Heading']).group()[0])
+            except:
+                pass
 
-        return gpx_path
\ No newline at end of file
+        self.add_row(content)
@@ -0,0 +1,274 @@
+"""
+Convert the flight_points table to a table partitioned by month or year on ak_datetime. Each partition is a separate
+table, so inserts, VACUUM/ANALYZE, and date-range queries only touch the partitions for the dates involved instead of
+the whole history of the table. Once flight_points is partitioned, import_track.import_data() creates new partitions as
+needed (with prepare_partitions()). The interval is stored in the comment on flight_points so that partitions created
+later always match it.
+
+The existing table is renamed to flight_points_unpartitioned and its rows are copied to the new table in a single
+transaction. The old table is kept (unless --drop_old is given) so it can be checked before being dropped manually.
+Views that depend on flight_points will still reference the old table and have to be recreated.
+
+Usage:
+    partition_flight_points.py <connection_txt> [--interval=<str>] [--drop_old]
+
+Examples:
+
+Required parameters:
+    connection_txt      Path of a text file containing information to connect to the DB. Each line
+                        in the text file must be in the form 'variable_name; variable_value.'
+                        Required variables: username, password, ip_address, port, db_name.
+
+Options:
+    -h, --help              Show this screen.
+    -i, --interval=<str>    Time span of each partition. Either 'month' or 'year' [default: month]
+    -d, --drop_old          Option to drop the original (unpartitioned) table after its rows are copied
+"""
+
+import re
+import sys
+import warnings
+import pandas as pd
+from sqlalchemy import text as sqlalchemy_text
+
+import db_utils
+import create_indexes
+from utils import get_cl_args
+
+PARTITIONED_TABLE = 'flight_points'
+PARTITION_COLUMN = 'ak_datetime'
+UNPARTITIONED_TABLE = 'flight_points_unpartitioned'
+DEFAULT_PARTITION = 'flight_points_default'
+
+# Partition name suffixes by interval. Partitions are named {table}_{suffix}, e.g. flight_points_y2021m06
+PARTITION_SUFFIX_FORMATS = {'month': 'y%Ym%m',
+                            'year': 'y%Y'}
+PARTITION_PERIODS = {'month': 'M',
+                     'year': 'Y'}
+
+# Comment stored on the partitioned table to record the interval of its partitions
+PARTITION_INTERVAL_COMMENT = 'partition_interval={interval}'
+
+
+def validate_interval(interval):
+    if interval not in PARTITION_SUFFIX_FORMATS:
+        raise ValueError("interval must be either 'month' or 'year' but '%s' was given" % interval)
+
+
+def get_partition_start(timestamps, interval):
+    '''
+    Get the start of the partition each timestamp belongs in
+
+    :param timestamps: pd.Series of datetimes
+    :param interval: either 'month' or 'year'
+    :return: pd.Series of partition start datetimes
+    '''
+    validate_interval(interval)
+
+    return pd.to_datetime(timestamps).dt.to_period(PARTITION_PERIODS[interval]).dt.start_time
+
+
+def get_partition_name(partition_start, interval, table=PARTITIONED_TABLE):
+    ''' Return the name of the partition that starts at partition_start'''
+    validate_interval(interval)
+
+    return '%s_%s' % (table, pd.Timestamp(partition_start).strftime(PARTITION_SUFFIX_FORMATS[interval]))
+
+
+def is_partitioned(conn, table=PARTITIONED_TABLE):
+    ''' Return True if table is a partitioned table'''
+    return conn.execute(
+        sqlalchemy_text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                        "WHERE partrelid = to_regclass(:table_name)::oid);"),
+        table_name=table
+    ).scalar()
+
+
+def get_partitions(conn, table=PARTITIONED_TABLE):
+    ''' Return a pd.Series of the names of all partitions of table (including the default partition)'''
+    return pd.read_sql(
+        sqlalchemy_text("SELECT child.relname AS name FROM pg_inherits "
+                        "INNER JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                        "WHERE pg_inherits.inhparent = to_regclass(:table_name)::oid;"),
+        conn,
+        params={'table_name': table}
+    )['name']
+
+
+def get_partition_interval(conn, table=PARTITIONED_TABLE):
+    '''
+    Get the partition interval that partition_table() stored in the comment on table
+
+    :return: either 'month' or 'year'
+    '''
+    comment = conn.execute(
+        sqlalchemy_text("SELECT obj_description(to_regclass(:table_name)::oid, 'pg_class');"),
+        table_name=table
+    ).scalar()
+    match = re.search(PARTITION_INTERVAL_COMMENT.format(interval=r'(\w+)'), comment or '')
+    if not match or match.group(1) not in PARTITION_SUFFIX_FORMATS:
+        raise RuntimeError("The partition interval of {table} isn't stored in its comment. Set it to the interval of"
+                           " the existing partitions by running \"COMMENT ON TABLE {table} IS '{comment}';\" with"
+                           " either 'month' or 'year'"
+                           .format(table=table, comment=PARTITION_INTERVAL_COMMENT.format(interval='<interval>')))
+
+    return match.group(1)
+
+
+def create_partitions(conn, timestamps, interval, table=PARTITIONED_TABLE, default_partition=DEFAULT_PARTITION):
+    '''
+    Create the partitions of table that rows with these timestamps belong in if they don't already exist. A partition
+    can't be created if the default partition already has rows in its range, so those rows stay in the default
+    partition (with a warning) rather than failing.
+
+    :param conn: SQLAlchemy Connection
+    :param timestamps: iterable of datetimes
+    :param interval: either 'month' or 'year'
+    :param table: name of the partitioned table
+    :param default_partition: name of the default partition of table
+    :return: list of the names of the partitions the timestamps belong in
+    '''
+    partition_starts = get_partition_start(pd.Series(timestamps).dropna(), interval).drop_duplicates().sort_values()
+    existing_partitions = get_partitions(conn, table).tolist()
+    partition_names = []
+    for partition_start in partition_starts:
+        partition_end = (pd.Period(partition_start, PARTITION_PERIODS[interval]) + 1).start_time
+        partition_name = get_partition_name(partition_start, interval, table)
+        # Creating a partition locks the whole table, so don't try if it already exists
+        if partition_name in existing_partitions:
+            partition_names.append(partition_name)
+            continue
+
+        range_params = {'start': partition_start.strftime('%Y-%m-%d'), 'end': partition_end.strftime('%Y-%m-%d')}
+        if default_partition in existing_partitions and conn.execute(
+                sqlalchemy_text('SELECT EXISTS (SELECT 1 FROM {default_partition} WHERE {column} >= :start AND '
+                                '{column} < :end);'
+                                .format(default_partition=default_partition, column=PARTITION_COLUMN)),
+                **range_params).scalar():
+            warnings.warn('{default_partition} already has rows from {start} to {end}, so new rows in that range will'
+                          ' also be stored there. Move them to a new {partition} partition to make queries of that'
+                          ' range faster'
+                          .format(default_partition=default_partition, partition=partition_name, **range_params))
+            partition_names.append(default_partition)
+            continue
+
+        conn.execute("CREATE TABLE {partition} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}');"
+                     .format(partition=partition_name, table=table, **range_params))
+        partition_names.append(partition_name)
+
+    return sorted(set(partition_names))
+
+
+def prepare_partitions(engine, timestamps, table=PARTITIONED_TABLE):
+    '''
+    Create any partitions of table that rows with these timestamps need. This runs in its own short transaction because
+    creating a partition takes a lock on the whole table, which shouldn't be held for the length of an import (or make
+    the import fail). Call it before the transaction that inserts the rows.
+
+    :param engine: SQLAlchemy Engine
+    :param timestamps: iterable of datetimes
+    :param table: name of the table that might be partitioned
+    :return: list of the names of the partitions the timestamps belong in or None if table isn't partitioned
+    '''
+    with engine.connect() as conn, conn.begin():
+        if not is_partitioned(conn, table):
+            return None
+        return create_partitions(conn, timestamps, get_partition_interval(conn, table), table)
+
+
+def partition_table(engine, interval='month', drop_old=False):
+    '''
+    Replace flight_points with a table partitioned by interval on ak_datetime and copy all existing rows to it
+
+    :param engine: SQLAlchemy Engine
+    :param interval: either 'month' or 'year'
+    :param drop_old: if True, drop the original table after its rows are copied
+    :return: list of the names of the partitions created
+    '''
+    validate_interval(interval)
+
+    with engine.connect() as conn, conn.begin():
+        if is_partitioned(conn):
+            raise RuntimeError('%s is already partitioned' % PARTITIONED_TABLE)
+
+        # Rename the existing table and its indexes so the new table and its indexes can have the original names
+        conn.execute('ALTER TABLE {table} RENAME TO {old_table};'
+                     .format(table=PARTITIONED_TABLE, old_table=UNPARTITIONED_TABLE))
+        index_names = pd.read_sql(
+            sqlalchemy_text('SELECT indexname FROM pg_indexes WHERE tablename = :table_name;'),
+            conn,
+            params={'table_name': UNPARTITIONED_TABLE}
+        )['indexname']
+        for index_name in index_names:
+            conn.execute('ALTER INDEX "{index}" RENAME TO "{new_index}";'
+                         .format(index=index_name, new_index=(index_name + '_unpartitioned')[-63:]))
+
+        # The primary key of a partitioned table has to include the partition column
+        conn.execute('CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                     'PARTITION BY RANGE ({column});'
+                     .format(table=PARTITIONED_TABLE, old_table=UNPARTITIONED_TABLE, column=PARTITION_COLUMN))
+        conn.execute('ALTER TABLE {table} ADD PRIMARY KEY (id, {column});'
+                     .format(table=PARTITIONED_TABLE, column=PARTITION_COLUMN))
+        # Store the interval so partitions created later by prepare_partitions() use the same one
+        conn.execute("COMMENT ON TABLE {table} IS '{comment}';"
+                     .format(table=PARTITIONED_TABLE, comment=PARTITION_INTERVAL_COMMENT.format(interval=interval)))
+
+        # Recreate foreign keys (e.g., to flights) and make the new table own the ID sequence so it isn't dropped with
+        #   the old table
+        foreign_keys = pd.read_sql(
+            sqlalchemy_text("SELECT pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+                            "WHERE conrelid = to_regclass(:table_name)::oid AND contype = 'f';"),
+            conn,
+            params={'table_name': UNPARTITIONED_TABLE}
+        )['definition']
+        for definition in foreign_keys:
+            conn.execute('ALTER TABLE %s ADD %s;' % (PARTITIONED_TABLE, definition))
+        id_sequence = conn.execute(
+            sqlalchemy_text("SELECT pg_get_serial_sequence(:table_name, 'id');"),
+            table_name=UNPARTITIONED_TABLE
+        ).scalar()
+        if id_sequence:
+            conn.execute('ALTER SEQUENCE %s OWNED BY %s.id;' % (id_sequence, PARTITIONED_TABLE))
+
+        # Rows that don't fit in any partition (e.g., if one wasn't created before inserting) go in the default
+        #   partition rather than failing
+        conn.execute('CREATE TABLE {partition} PARTITION OF {table} DEFAULT;'
+                     .format(partition=DEFAULT_PARTITION, table=PARTITIONED_TABLE))
+        timestamps = pd.read_sql(
+            'SELECT DISTINCT date_trunc(\'{interval}\', {column}) AS partition_start FROM {old_table};'
+            .format(interval=interval, column=PARTITION_COLUMN, old_table=UNPARTITIONED_TABLE),
+            conn
+        )['partition_start']
+        partition_names = create_partitions(conn, timestamps, interval)
+
+        # Indexes created on a partitioned table are created on every partition (including future ones)
+        conn.execute('CREATE INDEX IF NOT EXISTS {table}_geom_idx ON {table} USING gist (geom);'
+                     .format(table=PARTITIONED_TABLE))
+        for index_name, table, expression in create_indexes.QUERY_INDEXES:
+            if table == PARTITIONED_TABLE:
+                conn.execute('CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({expression});'
+                             .format(index_name=index_name, table=table, expression=expression))
+
+        conn.execute('INSERT INTO {table} SELECT * FROM {old_table};'
+                     .format(table=PARTITIONED_TABLE, old_table=UNPARTITIONED_TABLE))
+        if drop_old:
+            conn.execute('DROP TABLE %s;' % UNPARTITIONED_TABLE)
+
+    # Maintaining the partitions also runs ANALYZE on flight_points itself. Autovacuum only analyzes the partitions, so
+    #   the statistics of the whole table (which the planner uses for queries across partitions) are gathered here
+    db_utils.clear_cache()
+    db_utils.run_maintenance(engine, tables=partition_names + [DEFAULT_PARTITION])
+
+    return partition_names
+
+
+def main(connection_txt, interval='month', drop_old=False):
+
+    engine = db_utils.connect_db(connection_txt)
+    partition_names = partition_table(engine, interval=interval, drop_old=drop_old)
+    print('Created %d partitions of %s:\n\t-%s' % (len(partition_names), PARTITIONED_TABLE, '\n\t-'.join(partition_names)))
+
+
+if __name__ == '__main__':
+    args = get_cl_args(__doc__)
+    sys.exit(main(**args))
@@ -748,11 +748,10 @@ def import_landings(flights, ticket, landings_conn, sqlite_path, landings, recei
     new_flights['submission_method'] = 'survey123'
     new_flights['source_file'] = sqlite_path
     new_flights['fee_per_passenger'] = fee_per_passenger
-    new_flights.reindex(columns=LANDINGS_FLIGHT_COLUMNS.values()) \
-        .to_sql('flights', landings_conn, if_exists='append', index=False)
-    global_ids = pd.read_sql("SELECT id, agol_global_id FROM flights WHERE flight_id IN ('%s')"
-                             % "', '".join(new_flights.flight_id),
-                             landings_conn)
+    global_ids = db_utils.insert_returning(new_flights.reindex(columns=LANDINGS_FLIGHT_COLUMNS.values()),
+                                           'flights',
+                                           landings_conn,
+                                           returning=['id', 'agol_global_id'])
 
     # Calculate concessions fees and attach numeric IDs to landings and fees
     # some landings might have multiple landing types selected so split them
@@ -1596,13 +1595,21 @@ def main(config_json):
         params = read_json_params(config_json)
         # Open connections to the DBs and begin transactions so that if there's an exception, no data are inserted
         connection_info = params['db_credentials']
-        connection_template = 'postgresql://{username}:{password}@{ip_address}:{port}/{db_name}'
-        landings_engine = create_engine(connection_template.format(**connection_info['landings']))
-        tracks_engine = create_engine(connection_template.format(**connection_info['tracks']))
+        landings_engine = db_utils.get_engine(connection_info['landings'])
+        tracks_engine = db_utils.get_engine(connection_info['tracks'])
+        # Load the table columns and lookup tables used while processing submissions before starting the transactions
+        db_utils.warm_cache(landings_engine, tables=(),
+                            lookup_tables=('aircraft_types', 'operators', 'landing_locations'))
+        db_utils.warm_cache(tracks_engine, tables=('flights', 'flight_points'),
+                            lookup_tables=('operators', 'nps_mission_codes'))
 
         with landings_engine.connect() as l_conn, tracks_engine.connect() as t_conn, l_conn.begin(), t_conn.begin():
             poll_feature_service(params['log_dir'], params['download_dir'], params, params['ssl_cert'], l_conn, t_conn)
 
+        # Update statistics for any tables that changed now that the transactions are committed
+        db_utils.run_maintenance(landings_engine, vacuum=False)
+        db_utils.run_maintenance(tracks_engine, vacuum=False)
+
     except Exception as error:
         tb_frame = get_traceback_frame()
         exc_type, exc_value, exc_traceback = sys.exc_info()
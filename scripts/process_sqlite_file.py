@@ -64,9 +64,8 @@ def main(sqlite_path, config_json, overwrite_attachments=False, object_ids=None)
     
     # Open connections to the DBs and begin transactions so that if there's an exception, no data are inserted
     connection_info = params['db_credentials']
-    connection_template = 'postgresql://{username}:{password}@{ip_address}:{port}/{db_name}'
-    landings_engine = create_engine(connection_template.format(**connection_info['landings']))
-    tracks_engine = create_engine(connection_template.format(**connection_info['tracks']))
+    landings_engine = db_utils.get_engine(connection_info['landings'])
+    tracks_engine = db_utils.get_engine(connection_info['tracks'])
 
     # write the attachments to disk
     attachment_dir = os.path.join(download_dir, 'attachments')
@@ -0,0 +1,241 @@
+"""
+On-disk cache of query_tracks.query_tracks() results. Results are stored as GeoParquet files keyed by a hash of the
+normalized query parameters, so repeating a query (e.g., from a notebook) doesn't have to go back to the database.
+import_track.import_data() invalidates every entry whose date range overlaps the flights it imports, and the least
+recently used entries are removed once the cache is bigger than MAX_CACHE_SIZE. Entries are also keyed by the
+database they came from, so caches of different databases can share a directory.
+
+The cache directory is CACHE_DIR unless the environment variable named by CACHE_DIR_ENV_VAR is set. To share
+invalidation with imports run by other users or on another machine, set it to a directory they can all access.
+"""
+
+import os
+import json
+import time
+import tempfile
+import contextlib
+import hashlib
+import warnings
+import pandas as pd
+import geopandas as gpd
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.flightsdb_query_cache')
+CACHE_DIR_ENV_VAR = 'FLIGHTSDB_QUERY_CACHE_DIR'
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+
+# Seconds to wait for another process to release the index lock, and age in seconds after which a lock is assumed to
+#   have been left behind by a process that died
+LOCK_TIMEOUT = 30
+STALE_LOCK_AGE = 300
+
+# Maximum total size in bytes of all cached results
+MAX_CACHE_SIZE = 2 * 1024 ** 3
+
+
+def get_cache_dir(cache_dir=None):
+    ''' Return cache_dir if given, otherwise the directory set in the environment or CACHE_DIR'''
+    return cache_dir or os.environ.get(CACHE_DIR_ENV_VAR) or CACHE_DIR
+
+
+def get_database_id(engine):
+    ''' Return a string that identifies the database engine connects to (without the password)'''
+    url = engine.url
+    return '{driver}://{user}@{host}:{port}/{database}'.format(driver=url.drivername, user=url.username, host=url.host,
+                                                              port=url.port, database=url.database)
+
+
+@contextlib.contextmanager
+def _index_lock(cache_dir, timeout=LOCK_TIMEOUT):
+    '''
+    Hold an exclusive lock on the index of cache_dir so that concurrent readers and writers (possibly on different
+    machines sharing the directory) can't overwrite each other's changes. Creating a file with O_EXCL is atomic on
+    local and network file systems and works on every platform.
+    '''
+    lock_path = os.path.join(cache_dir, LOCK_FILE)
+    start_time = time.time()
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_AGE:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                # The lock was released between the two calls
+                continue
+            if time.time() - start_time > timeout:
+                raise RuntimeError('Timed out waiting for the query cache lock %s. If no other process is using the '
+                                   'cache, delete the file' % lock_path)
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def get_cache_key(start_date, end_date, mask=None, database=None, **query_kwargs):
+    '''
+    Get a hash of query parameters that's the same for equivalent queries (e.g., dates in different formats or
+    criteria with different whitespace)
+
+    :param start_date: beginning of the date range of the query
+    :param end_date: end of the date range of the query
+    :param mask: [optional] GeoDataFrame mask of the query
+    :param database: [optional] identifier of the database queried (from get_database_id()) so that results from
+                     different databases never share an entry
+    :param query_kwargs: any other query_tracks() keyword arguments
+    :return: hex digest string
+    '''
+    params = {k: v for k, v in query_kwargs.items() if v is not None}
+    params['database'] = database
+    params['start_date'] = pd.Timestamp(start_date).strftime('%Y-%m-%d')
+    params['end_date'] = pd.Timestamp(end_date).strftime('%Y-%m-%d')
+    if isinstance(params.get('bbox'), str):
+        params['bbox'] = [round(float(c), 6) for c in params['bbox'].split(',')]
+    if isinstance(params.get('sql_criteria'), str):
+        params['sql_criteria'] = ' '.join(params['sql_criteria'].split())
+    if mask is not None:
+        # The order of features doesn't change the result, so sort them before hashing
+        mask_wkb = sorted(mask.to_crs(epsg=4326).geometry.to_wkb())
+        params['mask'] = hashlib.sha256(b''.join(mask_wkb)).hexdigest()
+
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _read_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.isfile(index_path):
+        return {}
+    try:
+        with open(index_path) as j:
+            return json.load(j)
+    except ValueError:
+        # If the index is corrupted, start over rather than failing the query
+        return {}
+
+
+def _write_index(cache_dir, index):
+    # Write to a temporary file and then replace the index so it's never left half-written
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w') as j:
+        json.dump(index, j, indent=4)
+    os.replace(temp_path, index_path)
+
+
+def _remove_entries(cache_dir, index, keys):
+    for key in keys:
+        entry = index.pop(key)
+        try:
+            os.remove(os.path.join(cache_dir, entry['file']))
+        except OSError:
+            pass
+
+
+def get_cached_result(key, cache_dir=None):
+    '''
+    Return the cached result for key or None if it isn't cached
+
+    :param key: cache key from get_cache_key()
+    :param cache_dir: [optional] directory of the cache. Defaults to get_cache_dir()
+    :return: GeoPandas.GeoDataFrame or None
+    '''
+    cache_dir = get_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return None
+
+    with _index_lock(cache_dir):
+        index = _read_index(cache_dir)
+        if key not in index:
+            return None
+
+        try:
+            data = gpd.read_parquet(os.path.join(cache_dir, index[key]['file']))
+        except Exception:
+            _remove_entries(cache_dir, index, [key])
+            _write_index(cache_dir, index)
+            return None
+
+        index[key]['last_access'] = time.time()
+        _write_index(cache_dir, index)
+
+    return data
+
+
+def cache_result(key, data, start_date, end_date, cache_dir=None, max_size=MAX_CACHE_SIZE):
+    '''
+    Store a query result and remove the least recently used entries if the cache is bigger than max_size
+
+    :param key: cache key from get_cache_key()
+    :param data: GeoPandas.GeoDataFrame query result
+    :param start_date: beginning of the date range of the query
+    :param end_date: end of the date range of the query
+    :param cache_dir: [optional] directory of the cache. Defaults to get_cache_dir()
+    :param max_size: maximum total size in bytes of all cached results
+    '''
+    cache_dir = get_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Write the result to a temporary file first and only move it into place while holding the lock, so another
+    #   process can't read (or invalidate) a half-written file under the cached name
+    file_name = key + '.parquet'
+    file_descriptor, temp_path = tempfile.mkstemp(suffix='.parquet.tmp', dir=cache_dir)
+    os.close(file_descriptor)
+    try:
+        data.to_parquet(temp_path, index=False)
+    except Exception as e:
+        os.remove(temp_path)
+        warnings.warn('Could not cache query result because %s' % e)
+        return
+
+    with _index_lock(cache_dir):
+        os.replace(temp_path, os.path.join(cache_dir, file_name))
+        index = _read_index(cache_dir)
+        index[key] = {'file': file_name,
+                      'start_date': pd.Timestamp(start_date).strftime('%Y-%m-%d'),
+                      'end_date': pd.Timestamp(end_date).strftime('%Y-%m-%d'),
+                      'size': os.path.getsize(os.path.join(cache_dir, file_name)),
+                      'last_access': time.time()}
+
+        # Evict the least recently used entries until the cache fits, but always keep the one that was just added
+        total_size = sum(entry['size'] for entry in index.values())
+        for old_key in sorted(index, key=lambda k: index[k]['last_access']):
+            if total_size <= max_size or old_key == key:
+                break
+            total_size -= index[old_key]['size']
+            _remove_entries(cache_dir, index, [old_key])
+
+        _write_index(cache_dir, index)
+
+
+def invalidate(start_date=None, end_date=None, cache_dir=None):
+    '''
+    Remove all cached results whose date range overlaps start_date to end_date. If neither is given, clear the cache.
+
+    :param start_date: beginning of the date range of data that changed
+    :param end_date: end of the date range of data that changed
+    :param cache_dir: [optional] directory of the cache. Defaults to get_cache_dir()
+    :return: number of entries removed
+    '''
+    cache_dir = get_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    start_date = pd.Timestamp(start_date).strftime('%Y-%m-%d') if start_date is not None else '0000-00-00'
+    end_date = pd.Timestamp(end_date).strftime('%Y-%m-%d') if end_date is not None else '9999-99-99'
+    with _index_lock(cache_dir):
+        index = _read_index(cache_dir)
+        stale_keys = [key for key, entry in index.items()
+                      if entry['start_date'] <= end_date and entry['end_date'] >= start_date]
+        if stale_keys:
+            _remove_entries(cache_dir, index, stale_keys)
+            _write_index(cache_dir, index)
+
+    return len(stale_keys)
@@ -2,7 +2,7 @@
 Query a PostGIS database and either write the results to a file or return in memory as GeoDataFrame.
 
 Usage:
-    query_tracks.py <connection_txt> <start_date> <end_date> [--table=<str>] [--start_time=<str>] [--end_time=<str>] [--bbox=<str>] [--mask_file=<str>] [--mask_buffer_distance=<int>] [--clip_output] [--output_path=<str>] [--aircraft_info] [--sql_criteria=<str>]
+    query_tracks.py <connection_txt> <start_date> <end_date> [--table=<str>] [--start_time=<str>] [--end_time=<str>] [--bbox=<str>] [--mask_file=<str>] [--mask_buffer_distance=<int>] [--mask_simplify_tolerance=<int>] [--mask_max_vertices=<int>] [--clip_output] [--output_path=<str>] [--aircraft_info] [--sql_criteria=<str>] [--chunk_size=<int>] [--columns=<str>] [--resolution=<int>]
 
 Examples:
 
@@ -21,21 +21,39 @@ Options:
     -b, --bbox=<str>                    Bounding box coordinates to query records within in the format
                                         (xmin, ymin, xmax, ymax)
     -m, --mask_file=<str>               Path to a vector file (Point, Line, or Polygon) to spatially filter query
-                                        results. File extension must be either .geojson, .json, .shp, .csv,  or .gpx.
-                                        If you give a Point or Line vector file, you must also specify a
+                                        results. File extension must be either .geojson, .json, .gpkg, .shp, .csv,
+                                        or .gpx. If you give a Point or Line vector file, you must also specify a
                                         mask_buffer_distance.
     -d, --mask_buffer_distance=<int>    Integer distance in meters (as measured in Alaska Albers Equal Area Conic
                                         projection) to buffer around all features in mask_file.
+    -p, --mask_simplify_tolerance=<int>  Distance in meters (in Alaska Albers) that the mask can be simplified within
+                                        before it's used to filter results. Masks with many vertices make every
+                                        spatial comparison expensive.
+    -v, --mask_max_vertices=<int>       Maximum number of vertices per piece when subdividing the mask (with PostGIS
+                                        ST_Subdivide) so each piece has a tight bounding box for the spatial index.
+                                        Must be at least 5
     -c, --clip_output                   Option to specify that the result should be the intersection of mask_file and
                                         the result of the non-spatial query criteria. If this option is not given, all
                                         features that touch mask_file will be returned, but they will not be clipped
                                         to its shape
-    -o, --output_path=<str>             Path to write the result to.
+    -o, --output_path=<str>             Path to write the result to. Results written to .parquet (GeoParquet) or
+                                        .feather files keep native timestamp types and are much faster to write and
+                                        read back (with read_query_result()) than the other formats
     -a, --aircraft_info                 Option to return information about the aircraft (manufacturer, model,
                                         engine model, aircraft type, etc.) append to each row of the query result
     -q, --sql_criteria=<str>            Additional SQL criteria to append to a WHERE statement (e.g.,
                                         'flights.id IN (104, 105, 106)' to limit results to records with those
                                         flight IDs)
+    -n, --chunk_size=<int>              Maximum number of rows to read from the database and write to output_path at a
+                                        time. Only this many rows are held in memory at once. For .parquet and
+                                        .feather output, each chunk is written as a row group (or record batch)
+                                        [default: 50000]
+    -l, --columns=<str>                 Comma-separated list of columns to write to output_path. The geometry is
+                                        always written. By default, all columns are written
+    -r, --resolution=<int>              Distance in meters (in Alaska Albers) that returned lines can deviate from
+                                        the full-resolution lines. Only applies to flight_lines. Lines are returned at
+                                        the coarsest stored level of detail (see simplify_lines.py) within this
+                                        distance, which is a small fraction of the vertices for overview maps
 """
 
 import sys
@@ -43,18 +61,37 @@ import os
 import warnings
 import subprocess
 import docopt
+import json
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+from shapely.ops import transform as shapely_transform
+from sqlalchemy import text as sqlalchemy_text
 
 import db_utils
-from utils import get_cl_args
+import query_cache
+import simplify_lines
+import track_summaries
+from utils import get_cl_args, get_transformer
 
 FIONA_DRIVERS = {'.geojson': 'GeoJSON',
                  '.json': 'GeoJSON',
+                 '.gpkg': 'GPKG',
                  '.shp': 'ESRI Shapefile',
                  '.csv': 'CSV',
                  '.gpx': 'GPX'}
 
+# Binary columnar formats written with pyarrow. Unlike Fiona formats, these preserve native column types
+COLUMNAR_FORMATS = {'.parquet': 'Parquet',
+                    '.feather': 'Feather'}
+
+# Fiona drivers that can reliably append to an existing file. Results written with any other driver (i.e., GPX) have to
+#   be collected and written all at once
+APPENDABLE_DRIVERS = ['ESRI Shapefile', 'GeoJSON', 'GPKG']
+
+# Default number of rows per chunk when streaming query results
+CHUNK_SIZE = 50000
+
 def validate_bounding_box(bbox):
     error_msg = "bbox coordinates must be in the format 'xmin,ymin,xmax,ymax' (in WGS84) but {reason}. bbox given: %s" % bbox
 
@@ -74,67 +111,58 @@ def validate_bounding_box(bbox):
         warnings.warn('The bounding box given is outside of mainland Alaska')
 
 
-def get_mask_wkt(mask_gdf, buffer_distance=None):
+def get_mask_geometry(mask_gdf, buffer_distance=None, simplify_tolerance=None):
     '''
-    Get a Well-Known Text string from a
+    Get a single (multi-part) shapely geometry from all features of a mask
     :param mask_gdf: GeoDataframe from the vector mask file
     :param buffer_distance: distance in meters to buffer around the mask
-    :return:
+    :param simplify_tolerance: distance in meters that the dissolved mask can be simplified within
+    :return: shapely geometry
     '''
     mask_gdf['dissolve_field'] = 1
+    # Buffer and simplify in Alaska Albers so distances are in meters. Use the cached transformers rather than
+    #   .to_crs(), which looks up both CRSs every time it's called
+    to_albers = get_transformer('epsg:4326', 'epsg:3338', always_xy=True)
+    to_wgs84 = get_transformer('epsg:3338', 'epsg:4326', always_xy=True)
     if buffer_distance:
-        ak_albers_mask = mask_gdf.to_crs(epsg=3338)
-        mask_gdf.geometry = ak_albers_mask.buffer(buffer_distance).to_crs(epsg=4326)
+        mask_gdf.geometry = gpd.GeoSeries(
+            [shapely_transform(to_wgs84.transform, shapely_transform(to_albers.transform, g).buffer(buffer_distance))
+             for g in mask_gdf.geometry],
+            index=mask_gdf.index,
+            crs=mask_gdf.crs
+        )
     elif not (mask_gdf.geom_type == 'Polygon').all():
         raise ValueError("If specifying a mask_file, all features must either have a Polygon geometry type or "
                          "you must specify a mask_buffer_distance with either a Point or Line mask_file")
-    mask_wkt = mask_gdf.dissolve(by='dissolve_field').squeeze()['geometry'].wkt
+    mask_geometry = mask_gdf.dissolve(by='dissolve_field').geometry.iloc[0]
+
+    if simplify_tolerance:
+        simplified = shapely_transform(to_albers.transform, mask_geometry)\
+            .simplify(simplify_tolerance, preserve_topology=True)
+        mask_geometry = shapely_transform(to_wgs84.transform, simplified)
 
-    return mask_wkt
+    return mask_geometry
 
 
-def query_tracks(start_date, end_date, connection_txt=None, engine=None, table='flight_points', start_time='00:00', end_time='23:59', bbox=None, mask=None, mask_buffer_distance=None, clip_output=False, aircraft_info=False, sql_criteria=''):
+def get_mask_wkt(mask_gdf, buffer_distance=None):
+    '''
+    Get a Well-Known Text string from all features of a mask
+    :param mask_gdf: GeoDataframe from the vector mask file
+    :param buffer_distance: distance in meters to buffer around the mask
+    :return: WKT string
     '''
-    Query the overflights database with specified parameters. Results are returned as a GeoPandas.GeoDataFrame instance.
 
-    :param start_date:      ISO date string (YYYY-mm-dd) indicating the beginning of the date range to query within 
-    :param end_date:        ISO date string (YYYY-mm-dd) indicating the end of the date range to query within
-    :param connection_txt:  [optional] path to a text file containing postgres connection params for the overflights DB.
-                            The text file must be readable by db_utils.connect_db(). If engine is not given,
-                            connection_txt must be specified.
-    :param engine:          [optional] SQLAlchemy Engine instance for connecting to the overflights DB. If
-                            connection_txt is not given, engine must be specified.
-    :param table:           [optional] string representing the name of the table to return geometries from overflights
-                            DB. Options are either 'flight_points' (the default) or 'flight_lines'
-    :param start_time:      [optional] string representing the earliest time of day on a 24-hour clock to return data
-                            from. Must be in the format HH:MM or H:MM (e.g., 09:30 or 9:30) [Default: '00:00']
-    :param end_time:        [optional] string representing the latest time of day on a 24-hour clock to return data
-                            from. Must be in the format HH:MM or H:MM (e.g., 09:30 or 9:30) [Default: '23:59']
-    :param bbox:            [optional] WGS84 bounding box coordinates to query records within in the format 'xmin, ymin,
-                            xmax, ymax'. If a mask is specified, the bounding box will be ignored [Default: None]
-    :param mask:            [optional] Geopandas.GeoDataframe instance to to spatially filter query results. If you
-                            specify a mask with Point or Line geometries, you must also specify a mask_buffer_distance.
-                            [Default: None]
-    :param mask_buffer_distance: [optional] Integer distance in meters (as measured in Alaska Albers Equal Area Conic
-                                 projection) to buffer around all features in mask_file. [Default: None]
-    :param clip_output:     [optional] boolean to indicate that the result should be the intersection of mask_file and
-                            the result of the non-spatial query criteria. If this option is not given, all features
-                            that touch mask_file will be returned, but they will not be clipped to its shape
-                            [Default: False]
-    :param aircraft_info:   [optional] boolean to return information about the aircraft (manufacturer, model, engine
-                            model, aircraft type, etc.) appended to each row of the query result. These additional
-                            fields can also be used in the sql_criteria to aspatially filter results based on aircraft information
-                            (e.g., "type_aircraft = 'Fixed Wing Single-Engine'") [Default: False]
-    :param sql_criteria:    [optional] string representing additional SQL criteria to append to a WHERE statement (e.g.,
-                            'flights.id IN (104, 105, 106)' to limit results to records with those flight IDs)
+    return get_mask_geometry(mask_gdf, buffer_distance).wkt
 
-    :return:                GeoPandas.GeoDataFrame instance of query results.
+
+def compose_query(engine, start_date, end_date, table='flight_points', start_time='00:00', end_time='23:59', bbox=None, mask=None, mask_buffer_distance=None, mask_simplify_tolerance=None, mask_max_vertices=None, clip_output=False, aircraft_info=False, sql_criteria='', resolution=None):
     '''
+    Compose the SQL for a query of the overflights database. See query_tracks() for a description of the parameters.
+    All values are passed as bind parameters rather than formatted into the SQL. The mask in particular is bound once
+    as WKB, which is much smaller and cheaper for Postgres to parse than inlining its WKT.
 
-    if not engine:
-        if not connection_txt:
-            raise ValueError('You must either specify an SQLAalchemy Engine or connection_txt to connect to the database')
-        engine = db_utils.connect_db(connection_txt)
+    :return: tuple of (sqlalchemy.text SQL, dictionary of bind parameters)
+    '''
 
     with engine.connect() as conn, conn.begin():
         query_columns = pd.Series(
@@ -146,16 +174,40 @@ def query_tracks(start_date, end_date, connection_txt=None, engine=None, table='
             query_columns = query_columns.append(pd.Series(['aircraft_info.*']))
                 #['aircraft_info.' + c for c in db_utils.get_db_columns('aircraft_info', engine)])
 
+        # Get simplified lines instead of the full-resolution geometry if a resolution is given
+        line_tolerance = None
+        if resolution is not None:
+            if table != 'flight_lines':
+                warnings.warn('resolution was given, but it only applies to flight_lines so it will be ignored')
+            elif not simplify_lines.simplified_table_exists(conn):
+                warnings.warn('resolution was given, but the %s table does not exist (run simplify_lines.py to create'
+                              ' it) so full-resolution lines will be returned' % simplify_lines.SIMPLIFIED_TABLE)
+            else:
+                line_tolerance = simplify_lines.get_line_tolerance(resolution)
+
+    # Clip and return whichever geometry is being queried. Lines that haven't been simplified (e.g., imported before
+    #   simplify_lines.py was run) are returned at full resolution rather than dropped. Always filter with the table's
+    #   own geometry so its spatial index can be used
+    geom_column = f'{table}.geom'
+    filter_geom_column = f'{table}.geom'
+    simplified_join = ''
+    if line_tolerance:
+        geom_column = f'COALESCE({simplify_lines.SIMPLIFIED_TABLE}.geom, {table}.geom)'
+        simplified_join = f'LEFT JOIN {simplify_lines.SIMPLIFIED_TABLE} ' \
+                          f'ON {simplify_lines.SIMPLIFIED_TABLE}.flight_line_id = {table}.id ' \
+                          f'AND {simplify_lines.SIMPLIFIED_TABLE}.tolerance_m = :line_tolerance'
+        query_columns.replace({f'{table}.geom': f'{geom_column} AS geom'}, inplace=True)
+
     mask_specified = isinstance(mask, gpd.geodataframe.GeoDataFrame)
     if mask_specified:
         # Make sure the mask is in WGS84 (same as database features)
         if not mask.crs.to_epsg() == 4326:
             mask = mask.to_crs(epsg='4326')
 
-        mask_wkt = get_mask_wkt(mask, mask_buffer_distance)
         if clip_output:
             query_columns.replace(
-                {f'{table}.geom': "ST_Intersection(geom, ST_GeomFromText('%s', 4326)) AS geom" % mask_wkt},
+                {f'{table}.geom': f"ST_Intersection({geom_column}, query_mask.mask_geom) AS geom",
+                 f'{geom_column} AS geom': f"ST_Intersection({geom_column}, query_mask.mask_geom) AS geom"},
                 inplace=True)
             if table == 'flight_points':
                 warnings.warn("You specified clip_output=True, but you're querying the flight_points table. This will "
@@ -167,57 +219,457 @@ def query_tracks(start_date, end_date, connection_txt=None, engine=None, table='
         warnings.warn('clip_output was set to True, but you did not specify a mask_file to spatially filter query results.')
 
     # Compose the SQL
+    # Filter dates with a half-open range on the raw timestamp column (rather than casting it to a date) so that an
+    #   index on the column can be used. Comparing the column itself to constant timestamps also lets Postgres skip
+    #   partitions of flight_points (see partition_flight_points.py) outside of the date range when planning the query
+    params = {'start_date': start_date,
+              'end_date_exclusive': (pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')}
     if start_time and end_time:
+        # Time-of-day filters have to cast the timestamp to a time, but these expressions exactly match the expression
+        #   indexes created by create_indexes.py so they don't require a sequential scan
         # If the user is getting points, select points by their timestamp
         if table == 'flight_points':
-            time_clause = f"flight_points.ak_datetime::time >= '{start_time}' AND " \
-                          f"flight_points.ak_datetime::time <= '{end_time}'"
+            time_clause = " AND flight_points.ak_datetime::time >= :start_time AND " \
+                          "flight_points.ak_datetime::time <= :end_time"
         # Otherwise, the user is getting lines, so the only timestamps are the departure and landing times
         else:
-            time_clause = f"departure_datetime::time >= '{start_time}' AND landing_datetime::time <= '{end_time}'"
+            time_clause = " AND departure_datetime::time >= :start_time AND landing_datetime::time <= :end_time"
+        params.update({'start_time': start_time, 'end_time': end_time})
     else:
         time_clause = ''
+    if line_tolerance:
+        params['line_tolerance'] = line_tolerance
+
+    bbox_criteria = ''
+    if bbox:
+        bounds = [float(c) for c in bbox.split(',')] if isinstance(bbox, str) else list(bbox)
+        params.update(dict(zip(['xmin', 'ymin', 'xmax', 'ymax'], bounds)))
+        bbox_criteria = f" AND ST_Intersects(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326), {filter_geom_column})"
+
+    # Bind the mask once in a CTE so that it's only sent once, even when clipping. Filter by joining to the mask (rather
+    #   than with EXISTS) so Postgres can use the mask as the outer side of the join and probe the spatial index of the
+    #   queried table for each mask geometry instead of testing every row in the date range
+    mask_cte = ''
+    mask_join = ''
+    distinct = ''
+    order_by = ''
+    if mask_specified:
+        params['mask_wkb'] = get_mask_geometry(mask, mask_buffer_distance, mask_simplify_tolerance).wkb
+        mask_cte = 'WITH query_mask AS (SELECT ST_GeomFromWKB(:mask_wkb, 4326) AS mask_geom)'
+        # Split a complex mask into pieces with at most mask_max_vertices vertices. Each piece has a much smaller
+        #   bounding box than the whole mask, so the spatial index rules out more candidates and each exact
+        #   intersection test only has to look at a few vertices. Features can intersect more than one piece, so
+        #   remove duplicates with DISTINCT ON
+        if mask_max_vertices:
+            # ST_Subdivide fails with fewer than 5 vertices
+            if int(mask_max_vertices) < 5:
+                raise ValueError('mask_max_vertices must be at least 5 but %s was given' % mask_max_vertices)
+            params['mask_max_vertices'] = int(mask_max_vertices)
+            mask_cte += (', mask_pieces AS (SELECT ST_Subdivide(mask_geom, :mask_max_vertices) AS mask_geom '
+                         'FROM query_mask)')
+            mask_join = f'INNER JOIN mask_pieces ON ST_Intersects({filter_geom_column}, mask_pieces.mask_geom)'
+            if clip_output:
+                mask_join += ' CROSS JOIN query_mask'
+            distinct = f'DISTINCT ON ({table}.id)'
+            order_by = f'ORDER BY {table}.id'
+        else:
+            mask_join = f'INNER JOIN query_mask ON ST_Intersects({filter_geom_column}, query_mask.mask_geom)'
+
+    # sql_criteria is arbitrary SQL, so escape colons to keep SQLAlchemy from interpreting them as bind parameters
+    other_criteria = ' AND ' + sql_criteria.replace(':', '\\:') if sql_criteria else ''
 
-    sql = '''SELECT {columns} FROM {table}
+    sql = '''{mask_cte}
+          SELECT {distinct} {columns} FROM {table}
           INNER JOIN flights ON flights.id = {table}.flight_id 
+          {simplified_join}
           {aircraft_join}
+          {mask_join}
           WHERE 
-             {date_field}::date BETWEEN '{start_date}' AND '{end_date}' AND 
+             {date_field} >= CAST(:start_date AS timestamp)
+             AND {date_field} < CAST(:end_date_exclusive AS timestamp)
              {time_clause}
              {bbox_criteria}
-             {spatial_filter}
-             {other_criteria}'''\
-        .format(columns=', '.join(query_columns),
+             {other_criteria}
+          {order_by}'''\
+        .format(mask_cte=mask_cte,
+                distinct=distinct,
+                columns=', '.join(query_columns),
                 table=table,
+                simplified_join=simplified_join,
                 aircraft_join="INNER JOIN aircraft_info ON aircraft_info.registration = flights.registration" if aircraft_info else '',
-                date_field="ak_datetime" if table == 'flight_points' else "departure_datetime",
-                time_clause=time_clause if start_time and end_time else '',
-                start_date=start_date,
-                end_date=end_date,
-                start_time=start_time,
-                end_time=end_time,
-                bbox_criteria=f" AND ST_Intersects(ST_MakeEnvelope({bbox}, 4326), geom)" if bbox else "",
-                spatial_filter=f" AND ST_Intersects(geom, ST_GeomFromText('{mask_wkt}', 4326))" if mask_specified and not clip_output else '',
-                other_criteria=" AND " + sql_criteria if sql_criteria else ''
+                mask_join=mask_join,
+                date_field="flight_points.ak_datetime" if table == 'flight_points' else "flights.departure_datetime",
+                time_clause=time_clause,
+                bbox_criteria=bbox_criteria if not mask_specified else '',
+                other_criteria=other_criteria,
+                order_by=order_by
                 )
 
+    return sqlalchemy_text(sql), params
+
+
+def query_tracks(start_date, end_date, connection_txt=None, engine=None, table='flight_points', start_time='00:00', end_time='23:59', bbox=None, mask=None, mask_buffer_distance=None, mask_simplify_tolerance=None, mask_max_vertices=None, clip_output=False, aircraft_info=False, sql_criteria='', resolution=None, use_cache=False):
+    '''
+    Query the overflights database with specified parameters. Results are returned as a GeoPandas.GeoDataFrame instance.
+
+    :param start_date:      ISO date string (YYYY-mm-dd) indicating the beginning of the date range to query within 
+    :param end_date:        ISO date string (YYYY-mm-dd) indicating the end of the date range to query within
+    :param connection_txt:  [optional] path to a text file containing postgres connection params for the overflights DB.
+                            The text file must be readable by db_utils.connect_db(). If engine is not given,
+                            connection_txt must be specified.
+    :param engine:          [optional] SQLAlchemy Engine instance for connecting to the overflights DB. If
+                            connection_txt is not given, engine must be specified.
+    :param table:           [optional] string representing the name of the table to return geometries from overflights
+                            DB. Options are either 'flight_points' (the default) or 'flight_lines'
+    :param start_time:      [optional] string representing the earliest time of day on a 24-hour clock to return data
+                            from. Must be in the format HH:MM or H:MM (e.g., 09:30 or 9:30) [Default: '00:00']
+    :param end_time:        [optional] string representing the latest time of day on a 24-hour clock to return data
+                            from. Must be in the format HH:MM or H:MM (e.g., 09:30 or 9:30) [Default: '23:59']
+    :param bbox:            [optional] WGS84 bounding box coordinates to query records within in the format 'xmin, ymin,
+                            xmax, ymax'. If a mask is specified, the bounding box will be ignored [Default: None]
+    :param mask:            [optional] Geopandas.GeoDataframe instance to to spatially filter query results. If you
+                            specify a mask with Point or Line geometries, you must also specify a mask_buffer_distance.
+                            [Default: None]
+    :param mask_buffer_distance: [optional] Integer distance in meters (as measured in Alaska Albers Equal Area Conic
+                                 projection) to buffer around all features in mask_file. [Default: None]
+    :param mask_simplify_tolerance: [optional] Distance in meters (as measured in Alaska Albers Equal Area Conic
+                                    projection) that the mask can be simplified within. [Default: None]
+    :param mask_max_vertices: [optional] Maximum number of vertices per piece when subdividing the mask with
+                              ST_Subdivide. This makes spatial filtering much faster for complex masks. Must be at
+                              least 5. [Default: None]
+    :param clip_output:     [optional] boolean to indicate that the result should be the intersection of mask_file and
+                            the result of the non-spatial query criteria. If this option is not given, all features
+                            that touch mask_file will be returned, but they will not be clipped to its shape
+                            [Default: False]
+    :param aircraft_info:   [optional] boolean to return information about the aircraft (manufacturer, model, engine
+                            model, aircraft type, etc.) appended to each row of the query result. These additional
+                            fields can also be used in the sql_criteria to aspatially filter results based on aircraft information
+                            (e.g., "type_aircraft = 'Fixed Wing Single-Engine'") [Default: False]
+    :param sql_criteria:    [optional] string representing additional SQL criteria to append to a WHERE statement (e.g.,
+                            'flights.id IN (104, 105, 106)' to limit results to records with those flight IDs)
+    :param resolution:      [optional] distance in meters (as measured in Alaska Albers Equal Area Conic projection)
+                            that returned lines can deviate from the full-resolution lines. Only applies if table is
+                            'flight_lines'. Lines are returned at the coarsest level of detail stored by
+                            simplify_lines.py that is within this distance (e.g., 1000 for an overview map of a whole
+                            season). If None or smaller than the finest level, full-resolution lines are returned
+                            [Default: None]
+    :param use_cache:       [optional] boolean to return the result of an identical previous query from the local
+                            cache (see query_cache.py) if there is one, without connecting to the database. Otherwise
+                            the result is cached for next time [Default: False]
+
+    :return:                GeoPandas.GeoDataFrame instance of query results.
+    '''
+
+    if not engine:
+        if not connection_txt:
+            raise ValueError('You must either specify an SQLAalchemy Engine or connection_txt to connect to the database')
+        engine = db_utils.connect_db(connection_txt)
+
+    # Creating the engine doesn't connect to the database, so a cached result can still be returned without connecting
+    if use_cache:
+        cache_key = query_cache.get_cache_key(start_date, end_date, mask=mask,
+                                              database=query_cache.get_database_id(engine), table=table,
+                                              start_time=start_time, end_time=end_time, bbox=bbox,
+                                              mask_buffer_distance=mask_buffer_distance,
+                                              mask_simplify_tolerance=mask_simplify_tolerance,
+                                              mask_max_vertices=mask_max_vertices, clip_output=clip_output,
+                                              aircraft_info=aircraft_info, sql_criteria=sql_criteria,
+                                              resolution=resolution)
+        data = query_cache.get_cached_result(cache_key)
+        if data is not None:
+            return data
+
+    sql, params = compose_query(engine, start_date, end_date, table=table, start_time=start_time, end_time=end_time, bbox=bbox,
+                        mask=mask, mask_buffer_distance=mask_buffer_distance,
+                        mask_simplify_tolerance=mask_simplify_tolerance, mask_max_vertices=mask_max_vertices,
+                        clip_output=clip_output, aircraft_info=aircraft_info, sql_criteria=sql_criteria,
+                        resolution=resolution)
+
     with engine.connect() as conn, conn.begin():
-        data = gpd.GeoDataFrame.from_postgis(sql, conn, geom_col='geom')
+        data = gpd.GeoDataFrame.from_postgis(sql, conn, geom_col='geom', params=params)
 
     # Clipping will return null geometries if other SQL criteria would have returned additional features, so remove those empty geometries
     data = data.loc[~data.geometry.is_empty]
 
+    if use_cache:
+        query_cache.cache_result(cache_key, data, start_date, end_date)
+
     return data
 
 
-def main(connection_txt, start_date, end_date, table='flight_points', start_time='00:00', end_time='23:59', bbox=None, mask_file=None, mask_buffer_distance=None, clip_output=False, output_path=None, aircraft_info=False, sql_criteria=''):
+def compose_summary_query(start_date, end_date, by='day', operator_codes=None, bbox=None):
+    '''
+    Compose the SQL for query_summaries(). See query_summaries() for a description of the parameters
+
+    :return: tuple of the SQL string and a dict of its parameters
+    '''
+    params = {'start_date': start_date, 'end_date': end_date, 'cell_size': track_summaries.GRID_CELL_SIZE}
+    criteria = ['flight_date BETWEEN :start_date AND :end_date']
+    if operator_codes is not None:
+        params['operator_codes'] = list(operator_codes)
+        criteria.append('operator_code = ANY(:operator_codes)')
+    if bbox:
+        bounds = [float(c) for c in bbox.split(',')] if isinstance(bbox, str) else list(bbox)
+        params.update(dict(zip(['xmin', 'ymin', 'xmax', 'ymax'], bounds)))
+
+    cell_geom = 'ST_MakeEnvelope(cell_x * :cell_size, cell_y * :cell_size, (cell_x + 1) * :cell_size, ' \
+                '(cell_y + 1) * :cell_size, 3338)'
+    # Flights whose bounding box overlaps bbox
+    bbox_overlaps = 'bbox_xmax >= :xmin AND bbox_xmin <= :xmax AND bbox_ymax >= :ymin AND bbox_ymin <= :ymax'
+    if by == 'flight':
+        if bbox:
+            criteria.append(bbox_overlaps)
+        sql = 'SELECT * FROM flight_summaries WHERE {criteria} ORDER BY start_datetime'
+    elif by == 'day':
+        if bbox:
+            criteria.append(bbox_overlaps)
+        sql = 'SELECT flight_date, operator_code, count(*) AS n_flights, sum(duration_hrs) AS flight_hours, ' \
+              'sum(length_m) / 1000.0 AS length_km FROM flight_summaries WHERE {criteria} ' \
+              'GROUP BY flight_date, operator_code ORDER BY flight_date, operator_code'
+    elif by == 'cell':
+        if bbox:
+            criteria.append(f'ST_Intersects({cell_geom}, ST_Transform(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, '
+                            f'4326), 3338))')
+        sql = f'SELECT cell_x, cell_y, sum(n_flights) AS n_flights, sum(n_points) AS n_points, {cell_geom} AS geom ' \
+              'FROM daily_grid_counts WHERE {criteria} GROUP BY cell_x, cell_y'
+    else:
+        raise ValueError("by must be either 'flight', 'day', or 'cell' but '%s' was given" % by)
+
+    return sql.format(criteria=' AND '.join(criteria)), params
+
+
+def query_summaries(start_date, end_date, connection_txt=None, engine=None, by='day', operator_codes=None, bbox=None):
+    '''
+    Answer aggregate questions from the summary tables maintained by track_summaries.py instead of from flight_points.
+    Results are only as complete as the summary tables, so run track_summaries.py first if they haven't been created.
+
+    :param start_date:      ISO date string (YYYY-mm-dd) indicating the beginning of the date range to query within
+    :param end_date:        ISO date string (YYYY-mm-dd) indicating the end of the date range to query within
+    :param connection_txt:  [optional] path to a text file containing postgres connection params for the overflights DB
+    :param engine:          [optional] SQLAlchemy Engine instance for connecting to the overflights DB
+    :param by:              [optional] level of aggregation. Options are:
+                                'flight': one row of statistics per flight (time extent, duration, length, altitude
+                                    min/max/median/90th percentile, and bounding box)
+                                'day': number of flights, flight hours, and flight length in km per day and operator
+                                'cell': number of flights and points per grid cell (as a GeoDataFrame of cells in
+                                    Alaska Albers). Flights that span more than one day are counted once per day
+                            [Default: 'day']
+    :param operator_codes:  [optional] iterable of operator codes to limit results to [Default: None]
+    :param bbox:            [optional] WGS84 bounding box coordinates in the format 'xmin, ymin, xmax, ymax'. Only
+                            flights whose bounding box overlaps it (or cells that overlap it) are included
+                            [Default: None]
+
+    :return:                pandas.DataFrame (or GeoPandas.GeoDataFrame if by='cell') of aggregated results
+    '''
+
+    if not engine:
+        if not connection_txt:
+            raise ValueError('You must either specify an SQLAalchemy Engine or connection_txt to connect to the database')
+        engine = db_utils.connect_db(connection_txt)
+
+    sql, params = compose_summary_query(start_date, end_date, by=by, operator_codes=operator_codes, bbox=bbox)
+    sql = sqlalchemy_text(sql)
+    with engine.connect() as conn, conn.begin():
+        if by == 'cell':
+            data = gpd.GeoDataFrame.from_postgis(sql, conn, geom_col='geom', crs='epsg:3338', params=params)
+        else:
+            data = pd.read_sql(sql, conn, params=params)
+
+    return data
+
+
+def stream_tracks(start_date, end_date, connection_txt=None, engine=None, chunk_size=CHUNK_SIZE, **query_kwargs):
+    '''
+    Query the overflights database like query_tracks(), but read the result in chunks of at most chunk_size rows
+    through a server-side cursor and yield each one as a GeoPandas.GeoDataFrame. Only one chunk is held in memory at a
+    time, so this should be used for queries that return more rows than would comfortably fit in memory.
+
+    :param start_date:      ISO date string (YYYY-mm-dd) indicating the beginning of the date range to query within
+    :param end_date:        ISO date string (YYYY-mm-dd) indicating the end of the date range to query within
+    :param connection_txt:  [optional] path to a text file containing postgres connection params for the overflights DB
+    :param engine:          [optional] SQLAlchemy Engine instance for connecting to the overflights DB
+    :param chunk_size:      [optional] maximum number of rows per chunk [Default: CHUNK_SIZE]
+    :param query_kwargs:    [optional] any other keyword arguments to query_tracks()
+
+    :return:                generator of GeoPandas.GeoDataFrame instances
+    '''
+
+    if not engine:
+        if not connection_txt:
+            raise ValueError('You must either specify an SQLAalchemy Engine or connection_txt to connect to the database')
+        engine = db_utils.connect_db(connection_txt)
+
+    sql, params = compose_query(engine, start_date, end_date, **query_kwargs)
+
+    # stream_results makes psycopg2 use a named (server-side) cursor, which only sends chunk_size rows at a time instead
+    #   of the whole result. Named cursors only exist within a transaction
+    with engine.connect() as conn, conn.begin():
+        for chunk in pd.read_sql(sql, conn.execution_options(stream_results=True), params=params,
+                                 chunksize=chunk_size):
+            # PostGIS returns geometries as hex-encoded WKB, which from_wkb() parses directly (NULLs become None)
+            chunk['geom'] = gpd.GeoSeries.from_wkb(chunk['geom'], index=chunk.index)
+            chunk = gpd.GeoDataFrame(chunk, geometry='geom', crs='epsg:4326')
+
+            # Remove empty geometries from clipping as in query_tracks()
+            yield chunk.loc[~chunk.geometry.is_empty]
+
+
+def select_columns(chunks, columns):
+    ''' Yield each chunk with only the given columns (and the geometry column)'''
+    for chunk in chunks:
+        yield chunk[[c for c in chunk.columns if c in columns or c == chunk.geometry.name]]
+
+
+def get_geoparquet_table(chunk):
+    '''
+    Convert a GeoDataFrame to a pyarrow Table with geometries encoded as WKB and GeoParquet metadata so that
+    gpd.read_parquet() and gpd.read_feather() can read it back
+
+    :param chunk: GeoPandas.GeoDataFrame
+    :return: pyarrow.Table
+    '''
+    import pyarrow as pa
+
+    geometry_column = chunk.geometry.name
+    data = pd.DataFrame(chunk)
+    data[geometry_column] = np.array(chunk.geometry.to_wkb(), dtype=object)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+
+    geo_metadata = {'version': '1.0.0',
+                    'primary_column': geometry_column,
+                    'columns': {geometry_column: {'encoding': 'WKB',
+                                                  'geometry_types': [],
+                                                  'crs': chunk.crs.to_json_dict() if chunk.crs else None}}
+                    }
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'geo'] = json.dumps(geo_metadata).encode('utf-8')
+
+    return table.replace_schema_metadata(metadata)
+
+
+def write_columnar_chunks(chunks, output_path, file_format):
+    '''
+    Write GeoDataFrame chunks to a single GeoParquet or Feather file. Each chunk is written as soon as it's available,
+    as its own row group (Parquet) or record batch (Feather), so only one chunk has to be held in memory at a time.
+    Timestamps and all other column types are kept as is.
+
+    :param chunks: iterable of GeoPandas.GeoDataFrame instances with the same columns
+    :param output_path: path of the file to write
+    :param file_format: either 'Parquet' or 'Feather'
+    :return: total number of rows written
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    n_rows = 0
+    writer = None
+    schema = None
+    try:
+        for chunk in chunks:
+            table = get_geoparquet_table(chunk)
+            if writer is None:
+                # A column that's null for all of the first chunk doesn't have a type yet, so store it as a string
+                schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                                    for f in table.schema],
+                                   metadata=table.schema.metadata)
+                if file_format == 'Parquet':
+                    writer = pq.ParquetWriter(output_path, schema)
+                else:
+                    writer = pa.ipc.new_file(output_path, schema)
+            # Every chunk has to have the same schema as the first one
+            table = table.cast(schema.remove_metadata()).replace_schema_metadata(schema.metadata)
+            if file_format == 'Parquet':
+                writer.write_table(table, row_group_size=max(len(table), 1))
+            else:
+                writer.write_table(table)
+            n_rows += len(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+
+def write_chunks(chunks, output_path, driver, columns=None):
+    '''
+    Write GeoDataFrame chunks to a single file, appending each one to the file as soon as it's available. Fiona drivers
+    that can't append (see APPENDABLE_DRIVERS) are written once all chunks have been read, so the whole result has to
+    fit in memory.
+
+    :param chunks: iterable of GeoPandas.GeoDataFrame instances with the same columns
+    :param output_path: path of the file to write
+    :param driver: name of the Fiona driver to write with or one of the values of COLUMNAR_FORMATS
+    :param columns: [optional] iterable of column names to write. The geometry column is always written.
+    :return: total number of rows written
+    '''
+    if columns:
+        chunks = select_columns(chunks, columns)
+
+    if driver in COLUMNAR_FORMATS.values():
+        return write_columnar_chunks(chunks, output_path, driver)
+
+    if driver != 'CSV' and driver not in APPENDABLE_DRIVERS:
+        warnings.warn('The {driver} driver can\'t append to a file, so the whole result will be held in memory before'
+                      ' it\'s written. Write to a .parquet, .feather, .gpkg, or .geojson file to stream large results'
+                      .format(driver=driver))
+        chunks = list(chunks)
+        if len(chunks) > 1:
+            chunks = [gpd.GeoDataFrame(pd.concat(chunks, ignore_index=True), geometry=chunks[0].geometry.name,
+                                       crs=chunks[0].crs)]
+
+    n_rows = 0
+    schema = None
+    for chunk in chunks:
+        datetime_columns = chunk.columns[chunk.dtypes.apply(pd.api.types.is_datetime64_any_dtype)]
+        # convert all datetime cols to str because fiona (underlying GeoPandas) freaks out about datetimes
+        for c in datetime_columns:
+            chunk[c] = chunk[c].astype(str)
+
+        # The CSV driver can't append to an existing file, so write CSVs with pandas and store geometries as WKT
+        if driver == 'CSV':
+            csv_data = pd.DataFrame(chunk)
+            csv_data[chunk.geometry.name] = chunk.geometry.to_wkt()
+            csv_data.to_csv(output_path, mode='w' if n_rows == 0 else 'a', header=n_rows == 0, index=False)
+        # Use the schema of the first chunk for all of them because a column that's null for a whole chunk would
+        #   otherwise get a different type and the chunk couldn't be appended
+        elif schema is None:
+            schema = gpd.io.file.infer_schema(chunk)
+            chunk.to_file(output_path, driver=driver, schema=schema)
+        elif len(chunk):
+            chunk.to_file(output_path, driver=driver, schema=schema, mode='a')
+        n_rows += len(chunk)
+
+    return n_rows
+
+
+def read_query_result(path, columns=None):
+    '''
+    Read a query result written by main() (or any other vector file) back into a GeoDataFrame
+
+    :param path: path of a .parquet, .feather, or any file that GeoPandas.read_file() can read
+    :param columns: [optional] iterable of column names to read. Only supported for .parquet and .feather files,
+                    which only have to read the requested columns from disk
+    :return: GeoPandas.GeoDataFrame
+    '''
+    _, path_extension = os.path.splitext(path)
+    if path_extension == '.parquet':
+        return gpd.read_parquet(path, columns=columns)
+    elif path_extension == '.feather':
+        return gpd.read_feather(path, columns=columns)
+    else:
+        data = gpd.read_file(path)
+        return data[[c for c in data.columns if c in columns or c == data.geometry.name]] if columns else data
+
+
+def main(connection_txt, start_date, end_date, table='flight_points', start_time='00:00', end_time='23:59', bbox=None, mask_file=None, mask_buffer_distance=None, mask_simplify_tolerance=None, mask_max_vertices=None, clip_output=False, output_path=None, aircraft_info=False, sql_criteria='', chunk_size=CHUNK_SIZE, columns=None, resolution=None, return_data=False):
 
     if output_path:
-        _, path_extension = os.path.splitext(output_path)
-        if path_extension not in FIONA_DRIVERS:
-            supported_ext = sorted(FIONA_DRIVERS.keys())
+        _, output_extension = os.path.splitext(output_path)
+        output_drivers = {**FIONA_DRIVERS, **COLUMNAR_FORMATS}
+        if output_extension not in output_drivers:
+            supported_ext = sorted(output_drivers.keys())
             raise ValueError('Unsupported output file type: {extension}. File extension must be either {type_str}'
-                             .format(extension=path_extension,
+                             .format(extension=output_extension,
                                      type_str='%s, or %s' % (', '.join(supported_ext[:-1]), supported_ext[-1])
                                      )
                              )
@@ -242,16 +694,20 @@ def main(connection_txt, start_date, end_date, table='flight_points', start_time
 
 
     engine = db_utils.connect_db(connection_txt)
-    data = query_tracks(start_date, end_date, engine=engine, table=table, start_time=start_time, end_time=end_time,
-                        bbox=bbox, mask=mask, mask_buffer_distance=mask_buffer_distance, clip_output=clip_output,
-                        aircraft_info=aircraft_info, sql_criteria=sql_criteria)
+    query_kwargs = dict(table=table, start_time=start_time, end_time=end_time, bbox=bbox, mask=mask,
+                        mask_buffer_distance=mask_buffer_distance, mask_simplify_tolerance=mask_simplify_tolerance,
+                        mask_max_vertices=mask_max_vertices, clip_output=clip_output, aircraft_info=aircraft_info,
+                        sql_criteria=sql_criteria, resolution=resolution)
 
+    # If writing to a file, stream the result so the whole thing never has to be in memory while it's written. Reading
+    #   it back would defeat that, so it's only returned if the caller asks for it with return_data=True
     if output_path:
-        datetime_columns = data.columns[data.dtypes == 'datetime64[ns]']
-        # convert all datetime cols to str because fiona (underlying GeoPandas) freaks out about datetimes
-        for c in datetime_columns:
-            data[c] = data[c].astype(str)
-        data.to_file(output_path, driver=FIONA_DRIVERS[path_extension])
+        chunks = stream_tracks(start_date, end_date, engine=engine, chunk_size=chunk_size, **query_kwargs)
+        write_chunks(chunks, output_path, output_drivers[output_extension],
+                     columns=[c.strip() for c in columns.split(',')] if columns else None)
+        return read_query_result(output_path) if return_data else None
+
+    data = query_tracks(start_date, end_date, engine=engine, **query_kwargs)
 
     return data
 
@@ -0,0 +1,141 @@
+"""
+Create and populate a table of simplified versions of each flight line at a few tolerances (levels of detail) so that
+overview maps and exports (e.g., of a whole season) don't have to transfer every vertex of every line. Lines are
+simplified in Alaska Albers so tolerances are in meters. query_tracks.query_tracks() uses these lines when it's given
+a resolution. import_track.import_data() keeps this table up to date once it exists, so this script only needs to be
+run once to create it and simplify lines that were imported before it existed.
+
+Usage:
+    simplify_lines.py <connection_txt> [--rebuild]
+
+Examples:
+
+Required parameters:
+    connection_txt      Path of a text file containing information to connect to the DB. Each line
+                        in the text file must be in the form 'variable_name; variable_value.'
+                        Required variables: username, password, ip_address, port, db_name.
+
+Options:
+    -h, --help          Show this screen.
+    -r, --rebuild       Option to delete all existing simplified lines and recalculate them (e.g., after changing
+                        LINE_TOLERANCES). Otherwise, only lines that haven't been simplified yet are added
+"""
+
+import sys
+import pandas as pd
+from sqlalchemy import text as sqlalchemy_text
+
+import db_utils
+from utils import get_cl_args
+
+# Tolerances in meters (in Alaska Albers) that each line is simplified with
+LINE_TOLERANCES = [10, 100, 1000]
+
+SIMPLIFIED_TABLE = 'flight_lines_simplified'
+
+CREATE_SIMPLIFIED_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS flight_lines_simplified (
+        flight_line_id integer REFERENCES flight_lines(id) ON DELETE CASCADE,
+        tolerance_m integer,
+        n_vertices integer,
+        geom geometry(Geometry, 4326),
+        PRIMARY KEY (tolerance_m, flight_line_id)
+    );
+    CREATE INDEX IF NOT EXISTS flight_lines_simplified_flight_line_id_idx ON flight_lines_simplified (flight_line_id);
+    CREATE INDEX IF NOT EXISTS flight_lines_simplified_geom_idx ON flight_lines_simplified USING gist (geom);
+'''
+
+# ST_SimplifyPreserveTopology never collapses a line to nothing, so every line has a geometry at every tolerance even
+#   if it's shorter than the tolerance
+INSERT_SIMPLIFIED_LINES_SQL = '''
+    INSERT INTO flight_lines_simplified (flight_line_id, tolerance_m, n_vertices, geom)
+    SELECT flight_line_id, tolerance_m, ST_NPoints(geom), geom
+    FROM (
+        SELECT
+            flight_lines.id AS flight_line_id,
+            tolerances.tolerance_m,
+            ST_Transform(
+                ST_SimplifyPreserveTopology(ST_Transform(flight_lines.geom, 3338), tolerances.tolerance_m),
+                4326
+            ) AS geom
+        FROM flight_lines CROSS JOIN unnest(CAST(:tolerances AS integer[])) AS tolerances(tolerance_m)
+        WHERE flight_lines.flight_id = ANY(:flight_ids)
+    ) AS simplified
+    ON CONFLICT (tolerance_m, flight_line_id) DO NOTHING;
+'''
+
+
+def simplified_table_exists(conn, ttl=db_utils.CACHE_TTL):
+    '''
+    Return True if the simplified lines table exists in the DB conn is connected to. Pass ttl=0 when deciding whether
+    to write to it so a process started before the table was created doesn't skip it for up to ttl seconds
+    '''
+
+    return SIMPLIFIED_TABLE in db_utils.get_table_names(conn=conn, ttl=ttl).values
+
+
+def get_line_tolerance(resolution):
+    '''
+    Get the largest stored tolerance that's no bigger than resolution
+
+    :param resolution: distance in meters that returned lines can deviate from the full-resolution lines
+    :return: tolerance in meters or None if resolution is smaller than all tolerances (i.e., full resolution is needed)
+    '''
+    if resolution is None:
+        return None
+    tolerances = [t for t in LINE_TOLERANCES if t <= float(resolution)]
+
+    return max(tolerances) if tolerances else None
+
+
+def update_simplified_lines(conn, flight_ids):
+    '''
+    Add simplified versions of the lines of newly inserted flights. This should be called within the same transaction
+    that inserted the lines so the simplified lines can never be out of sync with them.
+
+    :param conn: SQLAlchemy Connection
+    :param flight_ids: iterable of numeric flight IDs (flights.id)
+    :return: number of simplified lines inserted
+    '''
+    flight_ids = [int(i) for i in flight_ids]
+    if not len(flight_ids):
+        return 0
+
+    return conn.execute(sqlalchemy_text(INSERT_SIMPLIFIED_LINES_SQL),
+                        tolerances=LINE_TOLERANCES,
+                        flight_ids=flight_ids).rowcount
+
+
+def create_simplified_table(engine, rebuild=False):
+    '''
+    Create the simplified lines table if it doesn't exist and simplify all lines that aren't simplified yet
+
+    :param engine: SQLAlchemy Engine
+    :param rebuild: if True, delete all existing simplified lines first
+    :return: number of flights whose lines were simplified
+    '''
+    with engine.connect() as conn, conn.begin():
+        conn.execute(CREATE_SIMPLIFIED_TABLE_SQL)
+        if rebuild:
+            conn.execute('TRUNCATE %s;' % SIMPLIFIED_TABLE)
+        flight_ids = pd.read_sql('SELECT DISTINCT flight_id FROM flight_lines WHERE id NOT IN '
+                                 '(SELECT flight_line_id FROM flight_lines_simplified);',
+                                 conn)['flight_id']
+        update_simplified_lines(conn, flight_ids)
+
+    db_utils.clear_cache()
+    db_utils.run_maintenance(engine, tables=[SIMPLIFIED_TABLE])
+
+    return len(flight_ids)
+
+
+def main(connection_txt, rebuild=False):
+
+    engine = db_utils.connect_db(connection_txt)
+    n_flights = create_simplified_table(engine, rebuild=rebuild)
+    print('Simplified lines of %d flights' % n_flights)
+
+
+if __name__ == '__main__':
+    args = get_cl_args(__doc__)
+    sys.exit(main(**args))
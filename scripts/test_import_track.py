@@ -0,0 +1,142 @@
+"""
+Tests of import_track.py functions that don't need a database. Run from this directory with
+
+    python -m unittest test_import_track
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import import_track
+from utils import get_transformer
+
+
+class TestCalcHeading(unittest.TestCase):
+
+    def test_calc_bearing_cardinal_directions(self):
+        # From (0, 0) to one degree north, east, south, and west
+        bearing = import_track.calc_bearing(np.zeros(4), np.zeros(4), [1, 0, -1, 0], [0, 1, 0, -1])
+        np.testing.assert_allclose(bearing, [0, 90, 180, 270])
+
+    def test_calc_bearing_scalars(self):
+        self.assertAlmostEqual(import_track.calc_bearing(0, 0, 1, 1), 45, delta=0.01)
+
+    def test_first_point_is_negative_one(self):
+        heading = import_track.calc_heading([60, 61, 61], [-150, -150, -149])
+        self.assertEqual(heading[0], -1)
+        self.assertEqual(heading[1], 0)
+        # Going east at 61°N, the initial bearing is a little north of 90°
+        self.assertEqual(heading[2], 90)
+
+    def test_nan_coordinates(self):
+        # The point without coordinates and the point after it don't have a heading
+        heading = import_track.calc_heading([0, np.nan, 1, 2], [0, 0, 0, 0])
+        np.testing.assert_array_equal(heading, [-1, -1, -1, 0])
+
+    def test_duplicate_consecutive_points(self):
+        # Identical points have no direction, which arctan2 (like math.atan2 in the per-point version) gives as 0
+        heading = import_track.calc_heading([0, 0, 0, 1], [0, 0, 1, 1])
+        np.testing.assert_array_equal(heading, [-1, 0, 90, 0])
+
+    def test_short_tracks(self):
+        self.assertEqual(len(import_track.calc_heading([], [])), 0)
+        np.testing.assert_array_equal(import_track.calc_heading([60], [-150]), [-1])
+
+
+def get_test_track(utc_datetimes):
+    '''
+    Make a track of points 1 km apart going due north along the central meridian of Alaska Albers, where northing
+    differences are exact distances in meters
+    '''
+    n_points = len(utc_datetimes)
+    # Albers takes x, y, but WGS84 coordinates come back in lat, lon order
+    latitude, longitude = get_transformer('epsg:3338', 'epsg:4326').transform(np.zeros(n_points),
+                                                                           1000000 + np.arange(n_points) * 1000)
+    return gpd.GeoDataFrame({'latitude': latitude,
+                             'longitude': longitude,
+                             'utc_datetime': pd.to_datetime(utc_datetimes)},
+                            geometry=gpd.points_from_xy(longitude, latitude),
+                            crs='epsg:4326')
+
+
+class TestDeriveKinematics(unittest.TestCase):
+
+    def setUp(self):
+        # 1 minute between the first 3 points, then a gap longer than seg_time_diff
+        self.utc_datetimes = ['2021-06-01 12:00:00', '2021-06-01 12:01:00', '2021-06-01 12:02:00',
+                              '2021-06-01 12:22:00']
+
+    def test_derived_fields(self):
+        gdf = import_track.derive_kinematics(get_test_track(self.utc_datetimes), seg_time_diff=15)
+
+        self.assertTrue(np.isnan(gdf.diff_m.iloc[0]))
+        np.testing.assert_allclose(gdf.diff_m.iloc[1:], 1000, rtol=1e-6)
+        np.testing.assert_array_equal(gdf.diff_seconds, [-1, 60, 60, -1])
+        np.testing.assert_allclose(gdf.m_per_sec.iloc[1:3], 1000 / 60.0, rtol=1e-6)
+        # 16.67 m/s * 1.94384 = 32.4 knots. Points without a valid time difference get 0
+        np.testing.assert_array_equal(gdf.knots, [0, 32, 32, 0])
+        np.testing.assert_array_equal(gdf.heading, [-1, 0, 0, 0])
+        self.assertTrue(np.isnan(gdf.previous_lat.iloc[0]))
+        np.testing.assert_array_equal(gdf.previous_lat.iloc[1:], gdf.latitude.iloc[:-1])
+        np.testing.assert_array_equal(gdf.previous_lon.iloc[1:], gdf.longitude.iloc[:-1])
+
+    def test_existing_knots_and_heading_are_kept(self):
+        gdf = get_test_track(self.utc_datetimes)
+        gdf['knots'] = [-5, np.nan, 10, 20]
+        gdf['heading'] = [7, 8, 9, 10]
+        gdf = import_track.derive_kinematics(gdf, seg_time_diff=15)
+
+        # Negative and null speeds are set to 0, but everything else is left as the source reported it
+        np.testing.assert_array_equal(gdf.knots, [0, 0, 10, 20])
+        np.testing.assert_array_equal(gdf.heading, [7, 8, 9, 10])
+
+    def test_duplicate_consecutive_points(self):
+        gdf = get_test_track(self.utc_datetimes[:2])
+        gdf = pd.concat([gdf, gdf.iloc[[1]]], ignore_index=True)
+        gdf = import_track.derive_kinematics(gdf, seg_time_diff=15)
+
+        # The repeated point has the same timestamp, so it has no valid time difference or speed
+        self.assertAlmostEqual(gdf.diff_m.iloc[2], 0)
+        np.testing.assert_array_equal(gdf.diff_seconds, [-1, 60, -1])
+        np.testing.assert_array_equal(gdf.knots, [0, 32, 0])
+        np.testing.assert_array_equal(gdf.heading, [-1, 0, 0])
+
+    def test_skip_fields(self):
+        gdf = import_track.derive_kinematics(get_test_track(self.utc_datetimes), skip_fields=['diff_m', 'heading'])
+        self.assertNotIn('diff_m', gdf)
+        self.assertNotIn('heading', gdf)
+        self.assertIn('knots', gdf)
+
+
+class TestParseGsatCoordinates(unittest.TestCase):
+
+    # (Lat/Lng string, (latitude, longitude) returned by the per-row parse_gsat_coordinates() that
+    #   parse_gsat_coordinate_column() replaced)
+    SAMPLES = [
+        ('62°37\'21.9600"N 150°44\'42.0000"W', (62.62276666666667, -150.74499999999998)),
+        ('12°30\'00.0000"S 45°15\'36.0000"E', (-12.5, 45.26)),
+        ('0°0\'0.0000"N 0°0\'0.0000"E', (0.0, 0.0)),
+        ('63°10\'5"N 151°2\'30"W', (63.168055555555554, -151.04166666666666)),
+        # Without a direction, coordinates are positive
+        ('62°37\'21.9600" 150°44\'42.0000"', (62.62276666666667, 150.74499999999998))
+    ]
+
+    def test_matches_per_row_parser(self):
+        coordinates, expected = zip(*self.SAMPLES)
+        latitude, longitude = import_track.parse_gsat_coordinate_column(pd.Series(coordinates))
+        np.testing.assert_allclose(latitude, [lat for lat, _ in expected])
+        np.testing.assert_allclose(longitude, [lon for _, lon in expected])
+
+    def test_unparseable_rows_are_nan(self):
+        latitude, longitude = import_track.parse_gsat_coordinate_column(pd.Series(['', np.nan, 'not a coordinate']))
+        self.assertTrue(latitude.isnull().all())
+        self.assertTrue(longitude.isnull().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests of query_cache.py that don't need a database. Run from this directory with
+
+    python -m unittest test_query_cache
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import geopandas as gpd
+from shapely.geometry import Point
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import query_cache
+
+
+def get_test_data():
+    return gpd.GeoDataFrame({'flight_id': [1, 2]}, geometry=[Point(-150, 63), Point(-151, 64)], crs='epsg:4326')
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.default_cache_dir = query_cache.CACHE_DIR
+        self.env_cache_dir = os.environ.pop(query_cache.CACHE_DIR_ENV_VAR, None)
+        # Make sure nothing in these tests touches the real default cache
+        query_cache.CACHE_DIR = os.path.join(self.cache_dir, 'default')
+
+    def tearDown(self):
+        query_cache.CACHE_DIR = self.default_cache_dir
+        os.environ.pop(query_cache.CACHE_DIR_ENV_VAR, None)
+        if self.env_cache_dir is not None:
+            os.environ[query_cache.CACHE_DIR_ENV_VAR] = self.env_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_import_invalidates_shared_cache_dir(self):
+        # The shared directory is set after query_cache was imported, like it would be for a long-running process
+        shared_dir = os.path.join(self.cache_dir, 'shared')
+        os.environ[query_cache.CACHE_DIR_ENV_VAR] = shared_dir
+        query_cache.cache_result('overlapping', get_test_data(), '2021-06-01', '2021-06-30')
+        query_cache.cache_result('not_overlapping', get_test_data(), '2021-08-01', '2021-08-31')
+        self.assertTrue(os.path.isdir(shared_dir))
+        self.assertFalse(os.path.isdir(query_cache.CACHE_DIR))
+
+        # This is the call import_track.import_data() makes after importing flights from 2021-06-15
+        n_removed = query_cache.invalidate('2021-06-15 08:00', '2021-06-15 10:00')
+
+        self.assertEqual(n_removed, 1)
+        self.assertIsNone(query_cache.get_cached_result('overlapping'))
+        self.assertEqual(len(query_cache.get_cached_result('not_overlapping')), 2)
+        self.assertEqual(sorted(f for f in os.listdir(shared_dir) if f.endswith('.parquet')),
+                         ['not_overlapping.parquet'])
+
+    def test_cache_key_includes_database(self):
+        key_a = query_cache.get_cache_key('2021-06-01', '2021-06-30', database='postgresql://user@host_a:5432/flights')
+        key_b = query_cache.get_cache_key('2021-06-01', '2021-06-30', database='postgresql://user@host_b:5432/flights')
+        self.assertNotEqual(key_a, key_b)
+
+    def test_result_is_moved_into_place(self):
+        query_cache.cache_result('key', get_test_data(), '2021-06-01', '2021-06-30', cache_dir=self.cache_dir)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted([query_cache.INDEX_FILE, 'key.parquet']))
+        self.assertEqual(len(query_cache.get_cached_result('key', cache_dir=self.cache_dir)), 2)
+
+    def test_failed_write_leaves_nothing(self):
+        query_cache.cache_result('key', 'not a GeoDataFrame', '2021-06-01', '2021-06-30', cache_dir=self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_lock_is_released(self):
+        with query_cache._index_lock(self.cache_dir):
+            self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, query_cache.LOCK_FILE)))
+        self.assertFalse(os.path.isfile(os.path.join(self.cache_dir, query_cache.LOCK_FILE)))
+
+
+if __name__ == '__main__':
+    unittest.main()
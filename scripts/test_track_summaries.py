@@ -0,0 +1,79 @@
+"""
+Tests of the SQL used to create and query the summary tables (track_summaries.py and query_tracks.query_summaries())
+that don't need a database. Run from this directory with
+
+    python -m unittest test_track_summaries
+"""
+
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import query_tracks
+import track_summaries
+
+# Postgres reserves these names for the system columns of every table
+SYSTEM_COLUMNS = ['tableoid', 'xmin', 'cmin', 'xmax', 'cmax', 'ctid']
+
+
+def get_table_columns(ddl, table):
+    '''
+    Get the column names of a table from the CREATE TABLE statement for it in ddl
+    '''
+    body = re.search(r'CREATE TABLE IF NOT EXISTS %s \((.*?)\n    \);' % table, ddl, re.DOTALL).group(1)
+
+    return [line.split()[0] for line in body.strip().splitlines() if not line.strip().startswith('PRIMARY KEY')]
+
+
+class TestSummaryTableSql(unittest.TestCase):
+
+    def test_no_system_column_names(self):
+        for table in track_summaries.SUMMARY_TABLES:
+            columns = get_table_columns(track_summaries.CREATE_SUMMARY_TABLES_SQL, table)
+            self.assertTrue(columns)
+            self.assertFalse(set(columns) & set(SYSTEM_COLUMNS), table)
+
+    def test_insert_columns_match_table(self):
+        insert_sql = track_summaries.INSERT_FLIGHT_SUMMARIES_SQL
+        insert_columns = re.search(r'INSERT INTO flight_summaries \((.*?)\)', insert_sql, re.DOTALL).group(1)
+        self.assertEqual([c.strip() for c in insert_columns.split(',')],
+                         get_table_columns(track_summaries.CREATE_SUMMARY_TABLES_SQL, 'flight_summaries'))
+
+
+class TestComposeSummaryQuery(unittest.TestCase):
+
+    def test_bbox_uses_bbox_columns(self):
+        columns = get_table_columns(track_summaries.CREATE_SUMMARY_TABLES_SQL, 'flight_summaries')
+        for by in ['flight', 'day']:
+            sql, params = query_tracks.compose_summary_query('2021-06-01', '2021-06-30', by=by,
+                                                             bbox='-151, 63, -150, 64')
+            self.assertIn('bbox_xmax >= :xmin AND bbox_xmin <= :xmax AND bbox_ymax >= :ymin AND bbox_ymin <= :ymax',
+                          sql)
+            # Every column name used in the criteria has to exist in the table
+            criteria = sql.split('WHERE')[1]
+            for name in re.findall(r'(?<![:\w])(bbox_\w+|[xy]m(?:in|ax))\b', criteria):
+                self.assertIn(name, columns)
+            self.assertEqual([params[k] for k in ['xmin', 'ymin', 'xmax', 'ymax']], [-151, 63, -150, 64])
+
+    def test_cell_bbox(self):
+        sql, params = query_tracks.compose_summary_query('2021-06-01', '2021-06-30', by='cell',
+                                                         bbox=[-151, 63, -150, 64])
+        self.assertIn('ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)', sql)
+        self.assertIn('FROM daily_grid_counts', sql)
+
+    def test_without_bbox(self):
+        sql, params = query_tracks.compose_summary_query('2021-06-01', '2021-06-30', by='flight',
+                                                         operator_codes=['NPS'])
+        self.assertNotIn('bbox_', sql)
+        self.assertNotIn('xmin', params)
+        self.assertEqual(params['operator_codes'], ['NPS'])
+
+    def test_invalid_by(self):
+        with self.assertRaises(ValueError):
+            query_tracks.compose_summary_query('2021-06-01', '2021-06-30', by='week')
+
+
+if __name__ == '__main__':
+    unittest.main()
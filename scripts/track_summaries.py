@@ -0,0 +1,197 @@
+"""
+Create and populate summary tables of flight tracks so that aggregate questions (e.g., how many flights or flight hours
+per day and operator, or how many flights passed through an area) can be answered without scanning flight_points.
+import_track.import_data() keeps these tables up to date once they exist, so this script only needs to be run once to
+create them and summarize flights that were imported before they existed. Deleting or editing flights doesn't update
+the grid counts, so run this again with --rebuild after doing so.
+
+Usage:
+    track_summaries.py <connection_txt> [--rebuild]
+
+Examples:
+
+Required parameters:
+    connection_txt      Path of a text file containing information to connect to the DB. Each line
+                        in the text file must be in the form 'variable_name; variable_value.'
+                        Required variables: username, password, ip_address, port, db_name.
+
+Options:
+    -h, --help          Show this screen.
+    -r, --rebuild       Option to delete all existing summaries and recalculate them. Otherwise, only flights that
+                        haven't been summarized yet are added
+"""
+
+import sys
+import pandas as pd
+from sqlalchemy import text as sqlalchemy_text
+
+import db_utils
+from utils import get_cl_args
+
+# Width in meters (in Alaska Albers) of the grid cells that points are counted in
+GRID_CELL_SIZE = 1000
+
+SUMMARY_TABLES = ['flight_summaries', 'daily_grid_counts']
+
+CREATE_SUMMARY_TABLES_SQL = '''
+    CREATE TABLE IF NOT EXISTS flight_summaries (
+        flight_id integer PRIMARY KEY REFERENCES flights(id) ON DELETE CASCADE,
+        registration varchar(50),
+        operator_code varchar(50),
+        flight_date date,
+        start_datetime timestamp,
+        end_datetime timestamp,
+        duration_hrs double precision,
+        n_points integer,
+        length_m double precision,
+        min_altitude_ft double precision,
+        max_altitude_ft double precision,
+        median_altitude_ft double precision,
+        p90_altitude_ft double precision,
+        bbox_xmin double precision,
+        bbox_ymin double precision,
+        bbox_xmax double precision,
+        bbox_ymax double precision
+    );
+    CREATE INDEX IF NOT EXISTS flight_summaries_flight_date_idx ON flight_summaries (flight_date);
+    CREATE TABLE IF NOT EXISTS daily_grid_counts (
+        flight_date date,
+        operator_code varchar(50),
+        cell_x integer,
+        cell_y integer,
+        n_flights integer,
+        n_points integer,
+        PRIMARY KEY (flight_date, operator_code, cell_x, cell_y)
+    );
+'''
+
+# Per-flight statistics. Altitude percentiles and the length are calculated from flight_points and flight_lines of
+#   only the flights in :flight_ids. The bounding box columns are prefixed because xmin and xmax are Postgres system
+#   column names
+INSERT_FLIGHT_SUMMARIES_SQL = '''
+    INSERT INTO flight_summaries (flight_id, registration, operator_code, flight_date, start_datetime, end_datetime,
+        duration_hrs, n_points, length_m, min_altitude_ft, max_altitude_ft, median_altitude_ft, p90_altitude_ft,
+        bbox_xmin, bbox_ymin, bbox_xmax, bbox_ymax)
+    SELECT
+        flights.id,
+        min(flights.registration),
+        min(flights.operator_code),
+        min(flight_points.ak_datetime)::date,
+        min(flight_points.ak_datetime),
+        max(flight_points.ak_datetime),
+        extract(epoch FROM max(flight_points.ak_datetime) - min(flight_points.ak_datetime)) / 3600.0,
+        count(*),
+        (SELECT sum(ST_Length(ST_Transform(flight_lines.geom, 3338))) FROM flight_lines
+            WHERE flight_lines.flight_id = flights.id),
+        min(flight_points.altitude_ft),
+        max(flight_points.altitude_ft),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY flight_points.altitude_ft),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY flight_points.altitude_ft),
+        min(ST_X(flight_points.geom)),
+        min(ST_Y(flight_points.geom)),
+        max(ST_X(flight_points.geom)),
+        max(ST_Y(flight_points.geom))
+    FROM flights INNER JOIN flight_points ON flights.id = flight_points.flight_id
+    WHERE flights.id = ANY(:flight_ids)
+    GROUP BY flights.id
+    ON CONFLICT (flight_id) DO NOTHING;
+'''
+
+# Point and flight counts per day, operator, and grid cell. Rather than adding the new flights' counts to existing rows
+#   (which would count a re-imported flight twice), recount every (day, operator, cell) that the new flights touch from
+#   all points on those days so the counts always match flight_points
+INSERT_GRID_COUNTS_SQL = '''
+    WITH new_cells AS (
+        SELECT DISTINCT
+            flight_points.ak_datetime::date AS flight_date,
+            coalesce(flights.operator_code, '') AS operator_code,
+            floor(ST_X(ST_Transform(flight_points.geom, 3338)) / :cell_size)::integer AS cell_x,
+            floor(ST_Y(ST_Transform(flight_points.geom, 3338)) / :cell_size)::integer AS cell_y
+        FROM flights INNER JOIN flight_points ON flights.id = flight_points.flight_id
+        WHERE flights.id = ANY(:flight_ids)
+    ),
+    affected_days AS (
+        SELECT DISTINCT flight_date FROM new_cells
+    ),
+    day_points AS (
+        SELECT
+            affected_days.flight_date,
+            coalesce(flights.operator_code, '') AS operator_code,
+            floor(ST_X(ST_Transform(flight_points.geom, 3338)) / :cell_size)::integer AS cell_x,
+            floor(ST_Y(ST_Transform(flight_points.geom, 3338)) / :cell_size)::integer AS cell_y,
+            flights.id AS flight_id
+        FROM affected_days
+        INNER JOIN flight_points ON flight_points.ak_datetime >= affected_days.flight_date
+            AND flight_points.ak_datetime < affected_days.flight_date + 1
+        INNER JOIN flights ON flights.id = flight_points.flight_id
+    )
+    INSERT INTO daily_grid_counts (flight_date, operator_code, cell_x, cell_y, n_flights, n_points)
+    SELECT flight_date, operator_code, cell_x, cell_y, count(DISTINCT flight_id), count(*)
+    FROM day_points INNER JOIN new_cells USING (flight_date, operator_code, cell_x, cell_y)
+    GROUP BY flight_date, operator_code, cell_x, cell_y
+    ON CONFLICT (flight_date, operator_code, cell_x, cell_y) DO UPDATE SET
+        n_flights = EXCLUDED.n_flights,
+        n_points = EXCLUDED.n_points;
+'''
+
+
+def summary_tables_exist(conn, ttl=db_utils.CACHE_TTL):
+    '''
+    Return True if all summary tables exist in the DB conn is connected to. Pass ttl=0 when deciding whether to write
+    to them so a process started before the tables were created doesn't skip them for up to ttl seconds
+    '''
+
+    table_names = db_utils.get_table_names(conn=conn, ttl=ttl)
+
+    return all(table in table_names.values for table in SUMMARY_TABLES)
+
+
+def update_summaries(conn, flight_ids):
+    '''
+    Add summaries of newly inserted flights. This should be called within the same transaction that inserted the
+    flights' points and lines so the summaries can never be out of sync with them. Grid counts are recounted for every
+    day, operator, and cell the flights touch, so passing a flight again doesn't count it twice.
+
+    :param conn: SQLAlchemy Connection
+    :param flight_ids: iterable of numeric flight IDs (flights.id)
+    '''
+    flight_ids = [int(i) for i in flight_ids]
+    if not len(flight_ids):
+        return
+
+    conn.execute(sqlalchemy_text(INSERT_FLIGHT_SUMMARIES_SQL), flight_ids=flight_ids)
+    conn.execute(sqlalchemy_text(INSERT_GRID_COUNTS_SQL), flight_ids=flight_ids, cell_size=GRID_CELL_SIZE)
+
+
+def create_summary_tables(engine, rebuild=False):
+    '''
+    Create the summary tables if they don't exist and summarize all flights that aren't summarized yet
+
+    :param engine: SQLAlchemy Engine
+    :param rebuild: if True, delete all existing summaries first
+    :return: number of flights summarized
+    '''
+    with engine.connect() as conn, conn.begin():
+        conn.execute(CREATE_SUMMARY_TABLES_SQL)
+        if rebuild:
+            conn.execute('TRUNCATE flight_summaries, daily_grid_counts;')
+        flight_ids = pd.read_sql('SELECT id FROM flights WHERE id NOT IN (SELECT flight_id FROM flight_summaries);',
+                                 conn)['id']
+        update_summaries(conn, flight_ids)
+
+    db_utils.clear_cache()
+    db_utils.run_maintenance(engine, tables=SUMMARY_TABLES)
+
+    return len(flight_ids)
+
+
+def main(connection_txt, rebuild=False):
+
+    engine = db_utils.connect_db(connection_txt)
+    n_flights = create_summary_tables(engine, rebuild=rebuild)
+    print('Summarized %d flights' % n_flights)
+
+
+if __name__ == '__main__':
+    args = get_cl_args(__doc__)
+    sys.exit(main(**args))
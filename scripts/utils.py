@@ -50,4 +50,29 @@ def get_cl_args(doc):
         elif re.fullmatch('\d*\.\d*', v):
             args[k] = float(v)
 
-    return args
\ No newline at end of file
+    return args
+
+
+# pyproj Transformers keyed by (from_crs, to_crs, always_xy). Transformers are only created the first time a given
+#   CRS pair is requested so that importing a module doesn't pay for PROJ setup until a projection is actually needed
+_TRANSFORMERS = {}
+
+
+def get_transformer(from_crs='epsg:4326', to_crs='epsg:3338', always_xy=False):
+    """
+    Get a cached pyproj Transformer for a pair of coordinate reference systems, creating it if necessary. Looking up
+    a CRS in the PROJ database is relatively slow, so reusing Transformers saves a lot of time when many files are
+    processed
+
+    :param from_crs: CRS of the input coordinates as any string pyproj understands (e.g., 'epsg:4326')
+    :param to_crs: CRS to project coordinates to
+    :param always_xy: if True, the Transformer will accept and return coordinates in x, y (lon, lat) order regardless
+                      of the axis order defined by either CRS
+    :return: pyproj.Transformer instance
+    """
+    key = (str(from_crs).lower(), str(to_crs).lower(), always_xy)
+    if key not in _TRANSFORMERS:
+        import pyproj
+        _TRANSFORMERS[key] = pyproj.Transformer.from_crs(key[0], key[1], always_xy=always_xy)
+
+    return _TRANSFORMERS[key]